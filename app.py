@@ -1,15 +1,17 @@
-import pandas as pd
-import numpy as np
-import keras
-import tensorflow as tf
-from keras.preprocessing.sequence import TimeseriesGenerator
+# keep module-level imports light, gunicorn workers load this file before serving
+# anything; pandas, numpy, keras, yfinance and plotly are imported where they are used
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 
-import yfinance
+import os
+import time
 
-from datetime import datetime
+import jobs
+import metrics
+
+# how often the page looks for new bars of a streaming.py run, 0 turns it off
+STREAM_POLL_SECONDS = float(os.environ.get('STREAM_POLL_SECONDS', 5))
 
 colors = {
     'background': '#111111',
@@ -28,15 +30,17 @@ tab_style = {
 }
 
 def download_and_process_data(stock_name):
-    import yfinance
     import pandas as pd
-    df = yfinance.download(stock_name,period='max')
+    from price_store import default_store
+    from ticker_info import default_info_store
+    # the metadata lookup runs on a thread while the prices are fetched
+    info = default_info_store().prefetch(stock_name)
+    df = default_store().history(stock_name, period='max')
     df.reset_index(inplace=True)
     df['Date'] = pd.to_datetime(df['Date'])
-    df.set_axis(df['Date'], inplace=True)
+    df.index = df['Date']
     close_data = df['Close'].values
     close_data = close_data.reshape((-1,1))
-    info = yfinance.Ticker(stock_name)
     return df, close_data, info
 
 def split_data(close_data, df):
@@ -49,78 +53,88 @@ def split_data(close_data, df):
     return close_train, close_test, date_train, date_test
 
 def sequence_to_supervised(look_back, close_train, close_test):
-    from keras.preprocessing.sequence import TimeseriesGenerator
-    train_generator = TimeseriesGenerator(close_train, close_train, length=look_back, batch_size=20)
-    test_generator = TimeseriesGenerator(close_test, close_test, length=look_back, batch_size=1)
+    from windowing import make_dataset
+    train_generator = make_dataset(close_train, look_back, batch_size=20)
+    test_generator = make_dataset(close_test, look_back, batch_size=1024)
+    return train_generator, test_generator
+
+def feature_generators(stock, look_back):
+    # like sequence_to_supervised, but batches are read from the ticker's memory-mapped closes
+    # in the feature store, one page-cached copy for every process that trains or scores it
+    from feature_store import default_feature_store
+    features = default_feature_store().get(stock, target='Close', scaled=False)
+    train_generator = features.dataset(look_back, batch_size=20, stop=features.train_end)
+    test_generator = features.dataset(look_back, batch_size=1024, start=features.train_end)
     return train_generator, test_generator
 
-def train_model(look_back, train_generator, epochs):
+def build_model(look_back, units=10):
     from keras.models import Sequential
     from keras.layers import LSTM, Dense
     lstm_model = Sequential()
     lstm_model.add(
-        LSTM(10,
+        LSTM(units,
         activation='relu',
         input_shape=(look_back,1))
     )
     lstm_model.add(Dense(1))
     lstm_model.compile(optimizer='adam', loss='mse')
-    lstm_model.fit(train_generator,epochs=epochs)
+    return lstm_model
+
+def train_model(look_back, train_generator, epochs, callbacks=None, units=10):
+    lstm_model = build_model(look_back, units)
+    lstm_model.fit(train_generator,epochs=epochs,callbacks=callbacks)
     
     return lstm_model
 
 def plot_train_test_graph(stock, model, test_generator, close_train, close_test, date_train, date_test):
-    from plotly import graph_objs as go
+    from figures import figure_spec
     prediction = model.predict(test_generator)
     close_train = close_train.reshape((-1))
     close_test = close_test.reshape((-1))
     prediction = prediction.reshape((-1))
-    trace1 = go.Scatter(
+    # window i predicts close_test[look_back + i], the first closes are only inputs
+    offset = len(close_test) - len(prediction)
+    trace1 = dict(
         x = date_train,
         y = close_train,
         mode = 'lines',
         name = 'Data'
     )
-    trace2 = go.Scatter(
-        x = date_test,
+    trace2 = dict(
+        x = date_test[offset:],
         y = prediction,
         mode = 'lines',
         name = 'Prediction',
         line=dict(color='red')
     )
-    trace3 = go.Scatter(
+    trace3 = dict(
         x = date_test,
         y = close_test,
         mode='lines',
         name = 'Ground Truth'
     )
-    layout = go.Layout(
+    layout = dict(
         title = stock,
         xaxis = {'title' : "Date"},
-        yaxis = {'title' : "Close"}
+        yaxis = {'title' : "Close"},
+        paper_bgcolor=colors['background'],
+        plot_bgcolor=colors["background"],
+        font={'color': colors['text']}
     )
-    figure = go.Figure(data=[trace1, trace2, trace3], layout=layout)
+    figure = figure_spec([trace1, trace2, trace3], layout)
     from sklearn.metrics import r2_score
-    score = r2_score(close_test[:-15],prediction)
-    figure.update_layout(
-    paper_bgcolor=colors['background'],
-    plot_bgcolor=colors["background"],
-    font_color=colors['text'])
+    score = r2_score(close_test[offset:],prediction)
     return figure, score
 
 def predict(num_prediction, model, close_data, look_back):
-    prediction_list = close_data[-look_back:]
-    
-    for _ in range(num_prediction):
-        x = prediction_list[-look_back:]
-        x = x.reshape((1, look_back, 1))
-        out = model.predict(x)[0][0]
-        prediction_list = np.append(prediction_list, out)
-    prediction_list = prediction_list[look_back-1:]
-        
+    import numpy as np
+    from forecasting import recursive_forecast
+    forecast = recursive_forecast(model, close_data, look_back, num_prediction)
+    prediction_list = np.concatenate([close_data[-1:], forecast])
     return prediction_list
 
 def predict_dates(num_prediction, df):
+    import pandas as pd
     last_date = df['Date'].values[-1]
     prediction_dates = pd.date_range(last_date, periods=num_prediction+1).tolist()
     return prediction_dates
@@ -132,35 +146,46 @@ def predicting(close_data, model, look_back, df):
     forecast_dates = predict_dates(num_prediction, df)
     return close_data, forecast, forecast_dates
 
-def plot_future_prediction(model, test_generator, close_train, close_test, df, forecast_dates, forecast):
-    from plotly import graph_objs as go
-    prediction = model.predict_generator(test_generator)
-    close_train = close_train.reshape((-1))
-    close_test = close_test.reshape((-1))
-    prediction = prediction.reshape((-1))
-    trace1 = go.Scatter(
-        x = df['Date'],
-        y = df['Close'],
+def predict_intervals(num_prediction, model, close_data, look_back, residuals):
+    import numpy as np
+    from forecasting import monte_carlo_forecast
+    _, bands = monte_carlo_forecast(model, close_data, look_back, num_prediction, residuals,
+                                    quantiles=(0.05, 0.25, 0.75, 0.95))
+    # like predict(), every band starts at the last close
+    return np.concatenate([np.repeat(close_data[-1:], len(bands))[:, np.newaxis], bands], axis=1)
+
+def plot_future_prediction(model, test_generator, close_train, close_test, df, forecast_dates, forecast, bands=None):
+    from figures import figure_spec
+    trace1 = dict(
+        x = df['Date'].values,
+        y = df['Close'].values,
         mode = 'lines',
         name = 'Data'
     )
-    trace2 = go.Scatter(
+    trace2 = dict(
         x = forecast_dates,
         y = forecast,
         mode = 'lines',
         name = 'Prediction'
     )
+    fan = []
+    if bands is not None:
+        # 5-95% and 25-75% of the Monte Carlo paths, each band is filled up from its lower edge
+        for (low, high), name, opacity in (((0, 3), '90% interval', 0.2), ((1, 2), '50% interval', 0.35)):
+            fan.append(dict(x = forecast_dates, y = bands[low], mode = 'lines', line=dict(width=0),
+                            showlegend=False, hoverinfo='skip'))
+            fan.append(dict(x = forecast_dates, y = bands[high], mode = 'lines', line=dict(width=0),
+                            fill='tonexty', fillcolor='rgba(255,105,180,{})'.format(opacity), name = name))
 
-    layout = go.Layout(
+    layout = dict(
         title = "FUTURE PREDICTION",
         xaxis = {'title' : "Date"},
-        yaxis = {'title' : "Close"}
+        yaxis = {'title' : "Close"},
+        paper_bgcolor=colors['background'],
+        plot_bgcolor=colors["background"],
+        font={'color': colors['text']}
     )
-    figure = go.Figure(data=[trace1, trace2], layout=layout)
-    figure.update_layout(
-    paper_bgcolor=colors['background'],
-    plot_bgcolor=colors["background"],
-    font_color=colors['text'])
+    figure = figure_spec([trace1] + fan + [trace2], layout)
     return figure
 
 '''
@@ -183,6 +208,7 @@ app = dash.Dash(
     title="Stock Price Predictor",
     update_title='Predicting the stocks...')
 server = app.server
+metrics.register(server)
 # df,close_data =download_and_process_data('RELIANCE.NS')
 
 
@@ -223,7 +249,12 @@ app.layout = html.Div([
                         "display": "block", "margin-left": "auto", "margin-right": "auto", "width": "60%"
                     }
                 ),
-                html.Div(id='r2_score', style={'textAlign':'center'})
+                html.Div(id='r2_score', style={'textAlign':'center'}),
+                html.Div(id='job_status', style={'textAlign':'center'}),
+                dcc.Store(id='job_id'),
+                dcc.Store(id='baseline_job'),
+                dcc.Store(id='viewport'),
+                dcc.Interval(id='job_poll', interval=1000, disabled=True)
             ]),
             html.Div([
                 dcc.Graph(id="training_plot")
@@ -236,10 +267,35 @@ app.layout = html.Div([
             html.Div([
                 dcc.Graph(id='future_plot')
             ], style={"margin":"0px"}),
+            html.Div([
+                dcc.Graph(id='live_plot', style={'display': 'none'}),
+                # enabled by update_live once a streamed ticker is entered
+                dcc.Interval(id='live_poll', interval=max(STREAM_POLL_SECONDS, 0.5) * 1000, disabled=True)
+            ], style={"margin":"0px"}),
         ], style=tab_style, selected_style=tab_selected_style)
     ], style={"height":"100%"})
 ], style={"color":"hotpink", 'backgroundColor': colors['background'], "paddingTop":"16px"})
 
+def plot_live(stock, bars):
+    import numpy as np
+    from figures import figure_spec
+    times = bars['times']
+    # the next bar is expected one median bar spacing after the last one
+    step = np.median(np.diff(times)) if len(times) > 1 else np.timedelta64(1, 'm')
+    traces = [dict(x = times, y = bars['closes'], mode = 'lines', name = 'Close'),
+              dict(x = times, y = bars['predicted'], mode = 'lines', name = 'One step forecast'),
+              dict(x = [times[-1], times[-1] + step], y = [bars['closes'][-1], bars['forecast']],
+                   mode = 'lines+markers', name = 'Next bar')]
+    layout = dict(
+        title = "{} LIVE".format(stock.upper()),
+        xaxis = {'title' : "Time"},
+        yaxis = {'title' : "Close"},
+        paper_bgcolor=colors['background'],
+        plot_bgcolor=colors["background"],
+        font={'color': colors['text']}
+    )
+    return figure_spec(traces, layout)
+
 def return_empty_graph():
     empty = {
             "layout": {
@@ -267,33 +323,246 @@ def return_empty_graph():
             }
     return empty
 
+def model_version(stock):
+    # tuned per ticker by tuning.py, the defaults otherwise
+    from tuning import best_config
+    from model_registry import architecture_hash
+    config = best_config(stock)
+    arch = architecture_hash([build_model, train_model], config['epochs'], config['units'])
+    return config['look_back'], config['units'], config['epochs'], arch
+
+def pipeline_key(stock, end_date):
+    # (ticker, data end-date, model version) of run_pipeline's outputs in the response cache
+    import pandas as pd
+    from price_store import ticker_key
+    from response_cache import response_key
+    look_back, _, _, arch = model_version(stock)
+    return response_key('pipeline', ticker_key(stock), pd.Timestamp(end_date).isoformat(), look_back, arch)
+
+def run_pipeline(stock, report=None):
+    if report is None:
+        report = lambda **progress: None
+    report(stage='downloading')
+    with metrics.span('download', ticker=stock):
+        df, close_data, info = download_and_process_data(stock)
+    with metrics.span('split', ticker=stock):
+        close_train, close_test, date_train, date_test = split_data(close_data, df)
+        look_back, units, epochs, arch = model_version(stock)
+        train_generator, test_generator = feature_generators(stock, look_back)
+    from keras.callbacks import LambdaCallback
+    from model_registry import default_registry
+    report(stage='training', epoch=0, epochs=epochs)
+    epoch_start = {}
+    def epoch_end(epoch, logs):
+        metrics.observe('training_epoch_seconds', time.perf_counter() - epoch_start['t'])
+        report(stage='training', epoch=epoch+1, epochs=epochs, loss=float(logs['loss']))
+    progress = LambdaCallback(
+        on_epoch_begin=lambda epoch, logs: epoch_start.update(t=time.perf_counter()),
+        on_epoch_end=epoch_end)
+    with metrics.span('train', ticker=stock):
+        lstm_model, _ = default_registry().get_or_train(
+            stock, look_back, arch, df['Date'].iloc[-1],
+            lambda: train_model(look_back,train_generator, epochs, [progress], units))
+    metrics.set_gauge('model_parameters', lstm_model.count_params())
+    report(stage='plotting')
+    with metrics.span('plot_train_test', ticker=stock):
+        figure_1, r2_score = plot_train_test_graph(stock, lstm_model, test_generator, close_train, close_test, date_train, date_test)
+    with metrics.span('predict', ticker=stock):
+        close_data, forecast, forecast_dates = predicting(close_data, lstm_model, look_back, df)
+        from forecasting import FORECAST_PATHS, one_step_residuals
+        bands = None
+        if FORECAST_PATHS:
+            # out-of-sample one-step errors of the test split are resampled along every path
+            bands = predict_intervals(len(forecast) - 1, lstm_model, close_data, look_back,
+                                      one_step_residuals(lstm_model, close_test, look_back))
+    with metrics.span('plot_future', ticker=stock):
+        figure_2 = plot_future_prediction(lstm_model, test_generator, close_train, close_test, df, forecast_dates, forecast, bands)
+    r2_score = "R2 Score : {}".format(r2_score)
+    from ticker_info import business_summary
+    with metrics.span('ticker_info', ticker=stock):
+        summary = business_summary(info)
+    from response_cache import default_response_cache
+    # stored before the job is marked done, a request arriving after that finds it
+    default_response_cache().put(pipeline_key(stock, df['Date'].iloc[-1]), (figure_1, figure_2, r2_score, summary))
+    return figure_1, figure_2, r2_score, summary
+
+def baseline_forecast(stock, report=None):
+    # a thread job next to run_pipeline; every request for the same bar shares one fit
+    from forecasters import BASELINE_MODEL
+    from price_store import ticker_key
+    from response_cache import default_response_cache, response_key
+    df, close_data, _ = download_and_process_data(stock)
+    return default_response_cache().get_or_compute(
+        response_key('baseline', ticker_key(stock), str(df['Date'].iloc[-1]), BASELINE_MODEL),
+        lambda: compute_baseline(stock, df, close_data))
+
+def compute_baseline(stock, df, close_data):
+    import logging
+    import numpy as np
+    from forecasters import BASELINE_MODEL, make_forecaster
+    try:
+        with metrics.span('baseline', ticker=stock, model=BASELINE_MODEL):
+            forecast = make_forecaster(BASELINE_MODEL).fit(close_data).predict(30)
+            forecast = np.concatenate([close_data[-1:, 0], forecast])
+            figure = plot_future_prediction(None, None, None, None, df, predict_dates(30, df), forecast)
+    except Exception:
+        logging.getLogger('stock.app').exception('baseline forecast for %s failed', stock)
+        return None
+    figure['traces'][1]['name'] = 'Baseline ({}), LSTM training...'.format(BASELINE_MODEL)
+    return figure
+
+def job_status_text(state):
+    if state['status'] == 'queued':
+        return "Waiting for a free worker..."
+    if state.get('stage') == 'downloading':
+        return "Downloading price history..."
+    if state.get('stage') == 'training':
+        text = "Training the model : epoch {}/{}".format(state['epoch'], state['epochs'])
+        if state.get('loss') is not None:
+            text += ", loss {:.6f}".format(state['loss'])
+        return text
+    return "Building the plots..."
+
+app.clientside_callback(
+    "function(value) { return window.innerWidth; }",
+    dash.dependencies.Output('viewport', 'data'),
+    [dash.dependencies.Input('stock_name', 'value')]
+    )
+
+def points_for(viewport):
+    import figures
+    # about two points per horizontal pixel is as much as a line plot can show
+    if not viewport:
+        return figures.FIGURE_POINTS
+    return int(min(max(2 * viewport, 500), 5000))
+
+def render_figures(specs, job_id, viewport, x_ranges=(None, None)):
+    import figures
+    return tuple(figures.render(spec, points_for(viewport), x_range, uirevision=job_id)
+                 for spec, x_range in zip(specs, x_ranges))
+
 @app.callback(
-    [dash.dependencies.Output('training_plot','figure'), 
+    [dash.dependencies.Output('training_plot','figure'),
     dash.dependencies.Output('future_plot','figure'),
-    dash.dependencies.Output('r2_score', 'children')],
+    dash.dependencies.Output('r2_score', 'children'),
     dash.dependencies.Output('stock_info', 'children'),
-    dash.dependencies.Input('stock_name','value'),
+    dash.dependencies.Output('job_id', 'data'),
+    dash.dependencies.Output('job_poll', 'disabled'),
+    dash.dependencies.Output('job_status', 'children'),
+    dash.dependencies.Output('baseline_job', 'data')],
+    [dash.dependencies.Input('stock_name','value'),
+    dash.dependencies.Input('job_poll', 'n_intervals'),
+    dash.dependencies.Input('training_plot', 'relayoutData'),
+    dash.dependencies.Input('future_plot', 'relayoutData')],
+    [dash.dependencies.State('job_id', 'data'),
+    dash.dependencies.State('viewport', 'data'),
+    dash.dependencies.State('baseline_job', 'data')]
     )
-def update_graph(value):
-    try:
-        stock = value
-        df, close_data, info = download_and_process_data(stock)
-    except:
-        empty = return_empty_graph()
-        return empty, empty, "No R2 Score to display", "No Asset Queried or Selected"
-    try:
-        close_train, close_test, date_train, date_test = split_data(close_data, df)
-        train_generator, test_generator = sequence_to_supervised(15,close_train,close_test)
-        lstm_model = train_model(15,train_generator, 7)
-        # lstm_model.save('lstm_model.h5')
-        figure_1, r2_score = plot_train_test_graph(stock, lstm_model, test_generator, close_train, close_test, date_train, date_test)
-        close_data, forecast, forecast_dates = predicting(close_data, lstm_model, 15, df)
-        figure_2 = plot_future_prediction(lstm_model, test_generator, close_train, close_test, df, forecast_dates, forecast)
-        r2_score = "R2 Score : {}".format(r2_score)
-        return figure_1, figure_2, r2_score, info.info['longBusinessSummary']
-    except:
-        empty = return_empty_graph()
-        return empty, empty, "No R2 Score to display", "No Asset Queried or Selected"
+def update_graph(value, n_intervals, training_relayout, future_relayout, job_id, viewport, baseline_job):
+    with metrics.profiled('update_graph'), metrics.span('callback'):
+        return poll_or_submit(value, job_id, viewport, training_relayout, future_relayout, baseline_job)
+
+CACHED = 'cache:'
+
+def pipeline_result(job_id):
+    # outputs of a finished job, or of a cached response when job_id is CACHED + its key
+    if not job_id:
+        return None
+    if job_id.startswith(CACHED):
+        from response_cache import default_response_cache
+        return default_response_cache().get(job_id[len(CACHED):])
+    state = jobs.status(job_id)
+    if state is None or state['status'] != 'done':
+        return None
+    return jobs.result(job_id)
+
+@app.callback(
+    [dash.dependencies.Output('live_plot', 'figure'),
+    dash.dependencies.Output('live_plot', 'style'),
+    dash.dependencies.Output('live_poll', 'disabled')],
+    [dash.dependencies.Input('live_poll', 'n_intervals'),
+    dash.dependencies.Input('stock_name', 'value')],
+    [dash.dependencies.State('viewport', 'data')]
+    )
+def update_live(n_intervals, value, viewport):
+    # bars pushed by streaming.py, read from its memory-mapped state; only a streamed ticker is polled
+    hidden = (dash.no_update, {'display': 'none'})
+    if not value or not STREAM_POLL_SECONDS:
+        return hidden + (True,)
+    from streaming import latest
+    bars = latest(value)
+    if bars is None:
+        # not streamed; during a poll it can also be the stream swapping its files, the next one retries
+        polled = 'live_poll.n_intervals' in [t['prop_id'] for t in dash.callback_context.triggered]
+        return hidden + (dash.no_update if polled else True,)
+    if len(bars['times']) == 0:
+        return hidden + (False,)
+    return render_figures((plot_live(value, bars),), 'live-' + value, viewport)[0], {}, False
+
+def rerender_zoomed(graph, relayout, job_id, viewport):
+    import figures
+    # a zoom or pan re-renders that graph from the full resolution job result
+    unchanged = (dash.no_update,) * 8
+    x_range = figures.parse_x_range(relayout)
+    if x_range is None and not (relayout or {}).get('xaxis.autorange'):
+        return unchanged
+    result = pipeline_result(job_id)
+    if result is None:
+        return unchanged
+    specs = result[:2]
+    index = 0 if graph == 'training_plot' else 1
+    out = list(unchanged)
+    out[index] = render_figures(specs[index:index + 1], job_id, viewport, (x_range,))[0]
+    return tuple(out)
+
+def poll_or_submit(value, job_id, viewport=None, training_relayout=None, future_relayout=None, baseline_job=None):
+    empty = return_empty_graph()
+    failed = (empty, empty, "No R2 Score to display", "No Asset Queried or Selected", None, True, "", None)
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'training_plot.relayoutData' in triggered:
+        return rerender_zoomed('training_plot', training_relayout, job_id, viewport)
+    if 'future_plot.relayoutData' in triggered:
+        return rerender_zoomed('future_plot', future_relayout, job_id, viewport)
+    if 'job_poll.n_intervals' not in triggered:
+        # a new ticker was submitted, training runs in the job pool and is polled below
+        if not value:
+            return failed
+        metrics.inc('requests_total')
+        import scheduler
+        # ranks the tickers the scheduler precomputes
+        scheduler.default_request_log().record(value)
+        scheduler.ensure_started()
+        from price_store import default_store
+        from response_cache import default_response_cache
+        # the last bar the store already has: a cold ticker or a top-up is left to the jobs
+        end_date = default_store().last_date(value)
+        if end_date is not None:
+            key = pipeline_key(value, end_date)
+            cached = default_response_cache().get(key)
+            if cached is not None:
+                figure_1, figure_2, r2_score, summary = cached
+                return render_figures((figure_1, figure_2), CACHED + key, viewport) + (
+                    r2_score, summary, CACHED + key, True, "", None)
+        # a statistical forecast to look at while the LSTM trains, on a thread of this worker so
+        # it does not queue behind training; identical submits from any worker share one job
+        baseline_job = jobs.submit_thread(baseline_forecast, value)
+        job_id = jobs.submit(run_pipeline, value)
+        return (dash.no_update,) * 4 + (job_id, False, "Waiting for a free worker...", baseline_job)
+    state = jobs.status(job_id) if job_id else None
+    if state is None or state['status'] == 'failed':
+        return failed
+    if state['status'] == 'done':
+        figure_1, figure_2, r2_score, summary = jobs.result(job_id)
+        return render_figures((figure_1, figure_2), job_id, viewport) + (r2_score, summary, job_id, True, "", None)
+    future = dash.no_update
+    baseline = jobs.status(baseline_job) if baseline_job else None
+    if baseline is not None and baseline['status'] in ('done', 'failed'):
+        # shown once, the LSTM forecast replaces it when the job is done
+        figure = jobs.result(baseline_job) if baseline['status'] == 'done' else None
+        if figure is not None:
+            future = render_figures((figure,), job_id, viewport)[0]
+        baseline_job = None
+    return (dash.no_update, future) + (dash.no_update,) * 3 + (False, job_status_text(state), baseline_job)
 
 if __name__=='__main__':
     app.run_server(debug=True)
\ No newline at end of file
@@ -31,10 +31,11 @@ tab_style = {
 def download_and_process_data(stock_name):
     import yfinance
     import pandas as pd
-    df = yfinance.download(stock_name, period="15y")
+    from price_store import default_store
+    df = default_store().history(stock_name, period="15y")
     df.reset_index(inplace=True)
     df['Date'] = pd.to_datetime(df['Date'])
-    df.set_axis(df['Date'], inplace=True)
+    df.index = df['Date']
     close_data = df['Close'].values
     close_data = close_data.reshape((-1,1))
     info = yfinance.Ticker(stock_name)
@@ -55,9 +56,9 @@ def scale_data(close_train, close_test):
     return close_train, close_test
 
 def sequence_to_supervised(look_back, close_train, close_test):
-    from keras.preprocessing.sequence import TimeseriesGenerator
-    train_generator = TimeseriesGenerator(close_train, close_train, length=look_back, batch_size=2)
-    test_generator = TimeseriesGenerator(close_test, close_test, length=look_back, batch_size=1)
+    from windowing import make_dataset
+    train_generator = make_dataset(close_train, look_back, batch_size=2)
+    test_generator = make_dataset(close_test, look_back, batch_size=1024)
     return train_generator, test_generator
 
 def train_model(look_back, train_generator, epochs):
@@ -74,7 +75,7 @@ def train_model(look_back, train_generator, epochs):
     lstm_model.add(Dense(2, activation='relu'))
     lstm_model.add(Dense(3))
     
-    opt = Adagrad(lr = 0.001)
+    opt = Adagrad(learning_rate = 0.001)
     lstm_model.compile(optimizer=opt, loss='mse')
     lstm_model.fit(train_generator,epochs=epochs)
     
@@ -88,7 +89,8 @@ def plot_train_test_graph(stock, model, train_generator, close_train, close_test
     # print(close_train, close_test, prediction)
     close_train = close_train.reshape((-1))
     close_test = close_test.reshape((-1))
-    prediction = prediction.reshape((-1))
+    # train_model ends in Dense(3), the first output is the next close
+    prediction = prediction[:, 0]
     trace1 = go.Scatter(
         x = date_train,
         y = close_train,
@@ -123,13 +125,9 @@ def plot_train_test_graph(stock, model, train_generator, close_train, close_test
     return figure, score
 
 def predict(num_prediction, model, close_data, look_back):
-    prediction_list = close_data[-look_back:]
-    for _ in range(num_prediction):
-        x = prediction_list[-look_back:]
-        x = x.reshape((1, look_back, 1))
-        out = model.predict(x)[0][0]
-        prediction_list = np.append(prediction_list, out)
-    prediction_list = prediction_list[look_back-1:]
+    from forecasting import recursive_forecast
+    forecast = recursive_forecast(model, close_data, look_back, num_prediction)
+    prediction_list = np.concatenate([close_data[-1:], forecast])
     return prediction_list
 
 def predict_dates(num_prediction, df):
@@ -153,7 +151,8 @@ def plot_future_prediction(model, test_generator, close_train, close_test, df, f
 
     close_train = close_train.reshape((-1))
     close_test = close_test.reshape((-1))
-    prediction = prediction.reshape((-1))
+    # train_model ends in Dense(3), the first output is the next close
+    prediction = prediction[:, 0]
     trace1 = go.Scatter(
         x = df['Date'],
         y = df['Close'],
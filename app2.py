@@ -1,15 +1,17 @@
-import pandas as pd
-import numpy as np
-import tensorflow as tf
-from keras.preprocessing.sequence import TimeseriesGenerator
+# keep module-level imports light, gunicorn workers load this file before serving
+# anything; pandas, numpy, keras, sklearn and plotly are imported where they are used
 import dash
 from dash import dcc
 from dash import html
 
-from datetime import datetime
+scaler = None
 
-from sklearn.preprocessing import MinMaxScaler
-scaler=MinMaxScaler(feature_range=(0,1))
+def get_scaler():
+    global scaler
+    if scaler is None:
+        from sklearn.preprocessing import MinMaxScaler
+        scaler=MinMaxScaler(feature_range=(0,1))
+    return scaler
 
 colors = {
     'background': '#111111',
@@ -28,15 +30,17 @@ tab_style = {
 }
 
 def download_and_process_data(stock_name):
-    import yfinance
     import pandas as pd
-    df = yfinance.download(stock_name, period="15y")
+    from price_store import default_store
+    from ticker_info import default_info_store
+    # the metadata lookup runs on a thread while the prices are fetched
+    info = default_info_store().prefetch(stock_name)
+    df = default_store().history(stock_name, period="15y")
     df.reset_index(inplace=True)
     df['Date'] = pd.to_datetime(df['Date'])
-    df.set_axis(df['Date'], inplace=True)
+    df.index = df['Date']
     close_data = df['Close'].values
     close_data = close_data.reshape((-1,1))
-    info = yfinance.Ticker(stock_name)
     return df, close_data, info
 
 def split_data(close_data, df):
@@ -49,14 +53,15 @@ def split_data(close_data, df):
     return close_train, close_test, date_train, date_test
 
 def scale_data(close_train, close_test):
+    scaler = get_scaler()
     close_train=scaler.fit_transform(close_train)
     close_test=scaler.transform(close_test)
     return close_train, close_test
 
 def sequence_to_supervised(look_back, close_train, close_test):
-    from keras.preprocessing.sequence import TimeseriesGenerator
-    train_generator = TimeseriesGenerator(close_train, close_train, length=look_back, batch_size=20)
-    test_generator = TimeseriesGenerator(close_test, close_test, length=look_back, batch_size=1)
+    from windowing import make_dataset
+    train_generator = make_dataset(close_train, look_back, batch_size=20)
+    test_generator = make_dataset(close_test, look_back, batch_size=1024)
     return train_generator, test_generator
 
 def train_model(look_back, train_generator, epochs):
@@ -73,7 +78,7 @@ def train_model(look_back, train_generator, epochs):
     lstm_model.add(Dense(2, activation='relu'))
     lstm_model.add(Dense(3))
     
-    opt = Adagrad(lr = 0.001)
+    opt = Adagrad(learning_rate = 0.001)
     lstm_model.compile(optimizer=opt, loss='mse')
     lstm_model.fit(train_generator,epochs=epochs)
     
@@ -87,7 +92,10 @@ def plot_train_test_graph(stock, model, test_generator, close_train, close_test,
     # print(close_train, close_test, prediction)
     close_train = close_train.reshape((-1))
     close_test = close_test.reshape((-1))
-    prediction = prediction.reshape((-1))
+    # train_model ends in Dense(3), the first output is the next close
+    prediction = prediction[:, 0]
+    # window i predicts close_test[look_back + i], the first closes are only inputs
+    offset = len(close_test) - len(prediction)
     trace1 = go.Scatter(
         x = date_train,
         y = close_train,
@@ -95,7 +103,7 @@ def plot_train_test_graph(stock, model, test_generator, close_train, close_test,
         name = 'Data'
     )
     trace2 = go.Scatter(
-        x = date_test,
+        x = date_test[offset:],
         y = prediction,
         mode = 'lines',
         name = 'Prediction',
@@ -114,7 +122,7 @@ def plot_train_test_graph(stock, model, test_generator, close_train, close_test,
     )
     figure = go.Figure(data=[trace1, trace2, trace3], layout=layout)
     from sklearn.metrics import r2_score
-    score = r2_score(close_test[:-15],prediction)
+    score = r2_score(close_test[offset:],prediction)
     figure.update_layout(
     paper_bgcolor=colors['background'],
     plot_bgcolor=colors["background"],
@@ -122,16 +130,14 @@ def plot_train_test_graph(stock, model, test_generator, close_train, close_test,
     return figure, score
 
 def predict(num_prediction, model, close_data, look_back):
-    prediction_list = close_data[-look_back:]
-    for _ in range(num_prediction):
-        x = prediction_list[-look_back:]
-        x = x.reshape((1, look_back, 1))
-        out = model.predict(x)[0][0]
-        prediction_list = np.append(prediction_list, out)
-    prediction_list = prediction_list[look_back-1:]
+    import numpy as np
+    from forecasting import recursive_forecast
+    forecast = recursive_forecast(model, close_data, look_back, num_prediction)
+    prediction_list = np.concatenate([close_data[-1:], forecast])
     return prediction_list
 
 def predict_dates(num_prediction, df):
+    import pandas as pd
     last_date = df['Date'].values[-1]
     prediction_dates = pd.date_range(last_date, periods=num_prediction+1).tolist()
     return prediction_dates
@@ -152,7 +158,8 @@ def plot_future_prediction(model, test_generator, close_train, close_test, df, f
 
     close_train = close_train.reshape((-1))
     close_test = close_test.reshape((-1))
-    prediction = prediction.reshape((-1))
+    # train_model ends in Dense(3), the first output is the next close
+    prediction = prediction[:, 0]
     trace1 = go.Scatter(
         x = df['Date'],
         y = df['Close'],
@@ -298,12 +305,16 @@ def update_graph(value):
         close_train, close_test, date_train, date_test = split_data(close_data, df)
         close_train, close_test = scale_data(close_train, close_test)
         train_generator, test_generator = sequence_to_supervised(15,close_train,close_test)
-        lstm_model = train_model(15,train_generator, 20)
+        from model_registry import default_registry, architecture_hash
+        lstm_model, _ = default_registry().get_or_train(
+            stock, 15, architecture_hash(train_model, 20), df['Date'].iloc[-1],
+            lambda: train_model(15,train_generator, 20), get_scaler())
         figure_1, r2_score = plot_train_test_graph(stock, lstm_model, test_generator, close_train, close_test, date_train, date_test)
         close_data, forecast, forecast_dates = predicting(close_data, lstm_model, 15, df)
         figure_2 = plot_future_prediction(lstm_model, test_generator, close_train, close_test, df, forecast_dates, forecast)
         r2_score = "R2 Score :s {}".format(r2_score)
-        return figure_1, figure_2, r2_score, info.info['longBusinessSummary']
+        from ticker_info import business_summary
+        return figure_1, figure_2, r2_score, business_summary(info)
     except:
         empty = return_empty_graph()
         return empty, empty, "No R2 Score to display", "No Asset Queried or Selected"
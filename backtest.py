@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+'''
+Walk-forward backtests of the app2.py LSTM.
+Instead of one 80/20 split, a ticker's history is cut at many origins: each fold
+trains on the bars before its origin (all of them with --window expanding, the
+last --train-size with --window rolling) and forecasts the next --test-size bars
+one step ahead. Folds are grouped into chains of --chain adjacent origins and
+the chains run on a process pool; inside a chain only the first fold trains from
+scratch, every later one fine-tunes the previous fold's weights on the bars
+added since (see incremental.fine_tune), which is where most of the time goes
+otherwise. One row per fold with MAE, RMSE, MAPE, R2, directional accuracy and
+the MAE of the naive last-close forecast is written to a parquet file.
+
+    python backtest.py AAPL MSFT --output folds.parquet
+    python backtest.py --universe universe.txt --window rolling --train-size 1000
+'''
+
+
+def walk_forward_origins(n, min_train, test_size, step=None, window='expanding', train_size=None):
+    # rows of (train_start, origin, test_end) indices into a series of length n
+    step = step or test_size
+    origins = np.arange(min_train, n - test_size + 1, step)
+    if window == 'rolling':
+        starts = np.maximum(origins - (train_size or min_train), 0)
+    elif window == 'expanding':
+        starts = np.zeros_like(origins)
+    else:
+        raise ValueError("Unknown window '{}'".format(window))
+    return np.column_stack([starts, origins, origins + test_size])
+
+
+def fold_metrics(actual, predicted, previous):
+    # previous : the close before each target, for directional accuracy and the naive forecast
+    error = predicted - actual
+    total = np.sum((actual - actual.mean()) ** 2)
+    return {'mae': float(np.mean(np.abs(error))),
+            'rmse': float(np.sqrt(np.mean(error ** 2))),
+            'mape': float(np.mean(np.abs(error) / np.abs(actual))),
+            'r2': float(1 - np.sum(error ** 2) / total) if total else float('nan'),
+            'direction': float(np.mean(np.sign(predicted - previous) == np.sign(actual - previous))),
+            'naive_mae': float(np.mean(np.abs(actual - previous)))}
+
+
+def run_chain(ticker, folds, look_back, epochs, period='max', seed=0):
+    import app2
+    from sklearn.preprocessing import MinMaxScaler
+    from price_store import default_store
+    from windowing import make_dataset, make_windows
+    from incremental import fine_tune
+
+    df = default_store().history(ticker, period=period)
+    if len(df) == 0:
+        raise ValueError('no price history for {}'.format(ticker))
+    close = df['Close'].values.reshape((-1, 1)).astype(np.float64)
+    dates = df.index
+    rows, model, scaler, previous_origin = [], None, None, None
+    for start, origin, end in folds:
+        t = time.perf_counter()
+        if model is None:
+            # the scaler stays the one fitted here for the whole chain, so weights carry over
+            scaler = MinMaxScaler(feature_range=(0,1)).fit(close[start:origin])
+            model = app2.train_model(look_back, make_dataset(scaler.transform(close[start:origin]), look_back,
+                                                             batch_size=20, shuffle=True, seed=seed), epochs)
+            mode = 'full'
+        else:
+            x, y = make_windows(scaler.transform(close[start:origin]), look_back)
+            new = np.arange(max(0, len(y) - (origin - previous_origin)), len(y))
+            model = fine_tune(model, x, y, new, seed)
+            mode = 'warm'
+        train_s = time.perf_counter() - t
+
+        # test windows start look_back bars before the origin, one per test bar
+        x, _ = make_windows(scaler.transform(close[origin - look_back:end]), look_back)
+        prediction = np.asarray(model(x.astype(np.float32), training=False))[:, :1]
+        prediction = scaler.inverse_transform(prediction)[:, 0]
+        actual = close[origin:end, 0]
+        previous = close[origin - 1:end - 1, 0]
+        rows.append(dict(fold_metrics(actual, prediction, previous), ticker=ticker, training=mode,
+                         train_start=dates[start], origin=dates[origin], test_end=dates[end - 1],
+                         train_bars=int(origin - start), test_bars=int(end - origin),
+                         train_s=train_s, total_s=time.perf_counter() - t))
+        previous_origin = origin
+    return rows
+
+
+def plan(tickers, args):
+    from price_store import default_store
+    chains = []
+    for ticker in tickers:
+        n = len(default_store().history(ticker, period=args.period))
+        folds = walk_forward_origins(n, max(args.min_train, args.look_back + 1), args.test_size,
+                                     args.step, args.window, args.train_size)
+        for i in range(0, len(folds), args.chain):
+            chains.append((ticker, folds[i:i + args.chain]))
+    return chains
+
+
+def _run(ticker, folds, look_back, epochs, period, seed):
+    start = time.perf_counter()
+    try:
+        return run_chain(ticker, folds, look_back, epochs, period, seed), None
+    except Exception as e:
+        return [], '{} : {!r} after {:.1f} s'.format(ticker, e, time.perf_counter() - start)
+
+
+def main(argv=None):
+    from batch_forecast import read_universe, pin_threads
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of the LSTM forecaster.')
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--universe', help='text file with one ticker per line')
+    parser.add_argument('--output', default='folds.parquet')
+    parser.add_argument('--window', choices=['expanding', 'rolling'], default='expanding')
+    parser.add_argument('--min-train', type=int, default=500, help='bars before the first origin')
+    parser.add_argument('--train-size', type=int, help='training bars of a rolling window, default --min-train')
+    parser.add_argument('--test-size', type=int, default=20)
+    parser.add_argument('--step', type=int, help='bars between origins, default --test-size')
+    parser.add_argument('--chain', type=int, default=10,
+                        help='adjacent folds per process, only the first one trains from scratch')
+    parser.add_argument('--period', default='max')
+    parser.add_argument('--look-back', type=int, default=15)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=0,
+                        help='intra-op threads per worker, default: cores / workers')
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    tickers = list(args.tickers) + (read_universe(args.universe) if args.universe else [])
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    chains = plan(tickers, args)
+    rows, errors = [], []
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=pin_threads, initargs=(threads,)) as pool:
+        futures = [pool.submit(_run, ticker, folds, args.look_back, args.epochs, args.period, args.seed)
+                   for ticker, folds in chains]
+        for n, future in enumerate(as_completed(futures), 1):
+            chain_rows, error = future.result()
+            rows.extend(chain_rows)
+            if error is not None:
+                errors.append(error)
+            print('[{}/{}] {} folds{}'.format(n, len(chains), len(chain_rows), '' if error is None else ' : ' + error))
+
+    folds = pd.DataFrame(rows)
+    if len(folds):
+        folds = folds.sort_values(['ticker', 'origin'], ignore_index=True)
+    folds.to_parquet(args.output, index=False)
+    if len(folds):
+        summary = folds.groupby('ticker')[['mae', 'naive_mae', 'rmse', 'r2', 'direction', 'total_s']].mean()
+        print(summary.assign(folds=folds.groupby('ticker').size()).to_string(float_format='{:.4f}'.format))
+    print('{} folds, {} failed chains, {:.1f} s -> {}'.format(
+        len(folds), len(errors), time.perf_counter() - start, args.output))
+    return 1 if chains and not rows else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+'''
+Batch forecasts for a universe of tickers.
+Runs the dashboard's pipeline (app.py: download, split, train on the unscaled
+closes with the app.model_version configuration, forecast) for every ticker in
+a universe file on a process pool and writes forecasts, R2 scores and
+per-stage timings to one parquet file. Models go through the registry under
+the dashboard's key, so it serves them afterwards without retraining.
+A worker that crashes breaks the pool and fails every ticker still on it,
+those are retried once, each on a single-worker pool of its own, so the crash
+only fails the ticker that caused it.
+
+    python batch_forecast.py universe.txt --output forecasts.parquet
+
+The universe file holds one ticker per line, blank lines and # comments are ignored.
+'''
+
+
+def read_universe(path):
+    tickers = []
+    with open(path) as f:
+        for line in f:
+            ticker = line.split('#')[0].strip()
+            if ticker and ticker not in tickers:
+                tickers.append(ticker)
+    return tickers
+
+
+def pin_threads(threads):
+    # one process per core already, more intra-op threads only oversubscribe
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def forecast_ticker(ticker, horizon, look_back=None, epochs=None, warm_start=False, parallel=None):
+    # parallel : (batch_size, epochs, patience, validation) of a parallel_training.py run to forecast with
+    import numpy as np
+    import app
+    from sklearn.metrics import r2_score
+    from forecasting import recursive_forecast
+    from model_registry import default_registry, architecture_hash
+
+    timings = {}
+    start = time.perf_counter()
+    df, close_data, info = app.download_and_process_data(ticker)
+    timings['download_s'] = time.perf_counter() - start
+
+    t = time.perf_counter()
+    close_train, close_test, date_train, date_test = app.split_data(close_data, df)
+    # the dashboard's configuration and registry key, unless overridden
+    config_look_back, units, config_epochs, arch = app.model_version(ticker)
+    if (look_back or config_look_back, epochs or config_epochs) != (config_look_back, config_epochs):
+        arch = architecture_hash([app.build_model, app.train_model], epochs or config_epochs, units)
+    look_back, epochs = look_back or config_look_back, epochs or config_epochs
+    mode = None
+    if parallel is not None:
+        from parallel_training import load_parallel
+        model, look_back = load_parallel(ticker, *parallel)
+        mode = 'parallel'
+        _, test_generator = app.sequence_to_supervised(look_back, close_train, close_test)
+    elif warm_start:
+        from windowing import make_dataset
+        from incremental import warm_start_or_train
+        model, _, mode = warm_start_or_train(
+            ticker, look_back, arch, df['Date'].iloc[-1], date_train, close_train,
+            lambda series: app.train_model(look_back, make_dataset(series, look_back, batch_size=20), epochs,
+                                           None, units))
+        _, test_generator = app.sequence_to_supervised(look_back, close_train, close_test)
+    else:
+        train_generator, test_generator = app.feature_generators(ticker, look_back)
+        model, _ = default_registry().get_or_train(
+            ticker, look_back, arch, df['Date'].iloc[-1],
+            lambda: app.train_model(look_back, train_generator, epochs, None, units))
+    timings['train_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    # test windows predict close_test[look_back:]
+    prediction = np.asarray(model.predict(test_generator, verbose=0))[:, 0]
+    r2 = r2_score(close_test[look_back:, 0], prediction)
+    forecast = recursive_forecast(model, close_data, look_back, horizon)
+    forecast_dates = app.predict_dates(horizon, df)[1:]
+    timings['forecast_s'] = time.perf_counter() - t
+    timings['total_s'] = time.perf_counter() - start
+
+    return dict(timings, ticker=ticker, status='ok', error=None, rows=len(df), training=mode,
+                data_end=df['Date'].iloc[-1], r2=float(r2),
+                forecast=[float(v) for v in forecast], forecast_dates=list(forecast_dates))
+
+
+def forecast_ticker_global(ticker, horizon):
+    # inference only, with the model trained by global_model.py
+    import app2
+    from sklearn.metrics import r2_score
+    from global_model import GLOBAL_LOOK_BACK, load_global, global_forecast, normalized_returns, one_step_predictions
+
+    timings = {}
+    start = time.perf_counter()
+    df, close_data, info = app2.download_and_process_data(ticker)
+    timings['download_s'] = time.perf_counter() - start
+
+    t = time.perf_counter()
+    model = load_global()
+    close = close_data[:, 0]
+    split = int(0.8 * len(close))
+    # the global model only saw the first 80% of its tickers, score on the rest with the scale of the first part
+    _, sigma = normalized_returns(close[:split])
+    prediction = one_step_predictions(model, close[split - GLOBAL_LOOK_BACK - 1:], GLOBAL_LOOK_BACK, sigma)
+    r2 = r2_score(close[split:], prediction)
+    forecast = global_forecast(model, close, GLOBAL_LOOK_BACK, horizon)
+    forecast_dates = app2.predict_dates(horizon, df)[1:]
+    timings['forecast_s'] = time.perf_counter() - t
+    timings['total_s'] = time.perf_counter() - start
+
+    return dict(timings, ticker=ticker, status='ok', error=None, rows=len(df), training='global',
+                data_end=df['Date'].iloc[-1], r2=float(r2),
+                forecast=[float(v) for v in forecast], forecast_dates=list(forecast_dates))
+
+
+def _run(ticker, look_back, epochs, horizon, warm_start, global_model=False, parallel=None):
+    start = time.perf_counter()
+    try:
+        if global_model:
+            return forecast_ticker_global(ticker, horizon)
+        return forecast_ticker(ticker, horizon, look_back, epochs, warm_start, parallel)
+    except Exception as e:
+        return {'ticker': ticker, 'status': 'failed', 'error': repr(e),
+                'total_s': time.perf_counter() - start}
+
+
+def _pool(workers, threads):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=pin_threads, initargs=(threads,))
+
+
+def _isolated(tickers, workers, threads, run_args):
+    # every ticker on a single-worker pool of its own, `workers` of them at a time,
+    # so a crash only fails the ticker that caused it
+    pending = list(tickers)
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            ticker = pending.pop(0)
+            pool = _pool(1, threads)
+            running[pool.submit(_run, ticker, *run_args)] = (ticker, pool)
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            ticker, pool = running.pop(future)
+            pool.shutdown()
+            try:
+                yield future.result()
+            except BrokenProcessPool as e:
+                yield {'ticker': ticker, 'status': 'failed', 'error': repr(e), 'total_s': 0.0}
+
+
+def forecast_all(tickers, workers, threads, run_args):
+    # yields one row per ticker as it finishes; a worker that dies (OOM, segfault) breaks the
+    # whole pool and every ticker still on it, those are retried once, each on a pool of its own
+    retry = []
+    with _pool(workers, threads) as pool:
+        futures = {pool.submit(_run, ticker, *run_args): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                retry.append(futures[future])
+    yield from _isolated(retry, workers, threads, run_args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train and forecast a universe of tickers.')
+    parser.add_argument('universe', help='text file with one ticker per line')
+    parser.add_argument('--output', default='forecasts.parquet')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=0,
+                        help='intra-op threads per worker, default: cores / workers')
+    parser.add_argument('--look-back', type=int,
+                        help="default: the dashboard's (tuned) value; other values are not served by the dashboard")
+    parser.add_argument('--epochs', type=int, help='default: like --look-back')
+    parser.add_argument('--horizon', type=int, default=30)
+    parser.add_argument('--warm-start', action='store_true',
+                        help='fine-tune the previous model on new bars instead of retraining (see incremental.py)')
+    parser.add_argument('--global-model', action='store_true',
+                        help='forecast with the model trained by global_model.py, no per-ticker training')
+    parser.add_argument('--parallel-model', action='store_true',
+                        help='forecast with the models trained by parallel_training.py, no training; '
+                             '--epochs, --batch-size, --patience and --validation pick the run')
+    parser.add_argument('--batch-size', type=int, help='with --parallel-model, default: the tuned setup')
+    parser.add_argument('--patience', type=int, default=10)
+    parser.add_argument('--validation', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    tickers = read_universe(args.universe)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    rows = []
+    parallel = None
+    if args.parallel_model:
+        from parallel_training import tuned_setup
+        # the same defaults as parallel_training.py
+        parallel = (args.batch_size or tuned_setup()['batch_size'], args.epochs or 100, args.patience,
+                    args.validation)
+    run_args = (args.look_back, args.epochs, args.horizon, args.warm_start, args.global_model, parallel)
+    for n, row in enumerate(forecast_all(tickers, args.workers, threads, run_args), 1):
+        rows.append(row)
+        print('[{}/{}] {} {}{} in {:.1f} s{}'.format(
+            n, len(tickers), row['ticker'], row['status'],
+            ' ({})'.format(row['training']) if row.get('training') else '', row['total_s'],
+            '' if row['error'] is None else ' : ' + row['error']))
+    pd.DataFrame(rows).to_parquet(args.output, index=False)
+    failed = sum(row['status'] != 'ok' for row in rows)
+    print('{} tickers, {} failed, {:.1f} s -> {}'.format(
+        len(tickers), failed, time.perf_counter() - start, args.output))
+    return 1 if failed == len(tickers) and tickers else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+'''
+Payload size and serialization time of the dashboard figures.
+A price series of each length is plotted the old way, as a full-resolution
+go.Figure serialized with plotly's json encoder, and through figures.render()
+with json number lists and with base64 typed arrays.
+Run from the repository root with: python -m benchmarks.figures
+'''
+
+
+def series(length, seed):
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today().floor('min'), periods=length, freq='min')
+    return dates.values, 100 * np.exp(np.cumsum(rng.normal(0, 0.001, length)))
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import plotly
+    from plotly import graph_objs as go
+    import figures
+    for length in args.lengths:
+        x, y = series(length, args.seed)
+        layout = {'title': 'BENCH', 'xaxis': {'title': 'Date'}, 'yaxis': {'title': 'Close'}}
+
+        def legacy():
+            figure = go.Figure(data=[go.Scatter(x=x, y=y, mode='lines', name='Data')], layout=go.Layout(layout))
+            return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+
+        spec = figures.figure_spec([{'x': x, 'y': y, 'mode': 'lines', 'name': 'Data'}], layout)
+        cases = [('go.Figure, full resolution', legacy)]
+        for encoding in ('json', 'typed'):
+            def rendered(encoding=encoding):
+                figure = figures.render(spec, args.points, encoding=encoding)
+                return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+            cases.append(('render {} points, {}'.format(args.points, encoding), rendered))
+
+        print('{} points'.format(length))
+        for name, fn in cases:
+            seconds, payload = timed(fn, args.repeat)
+            print('    {:34} {:9.1f} KB  {:8.1f} ms'.format(name, len(payload) / 1024, seconds * 1e3))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+'''
+Latency of the 30 day forecast: the old per-step model.predict loop against
+forecasting.recursive_forecast, for one ticker and for a batch of tickers, and
+the cost of a --paths Monte Carlo forecast (monte_carlo_forecast).
+Run from the repository root with: python -m benchmarks.forecast
+'''
+
+
+def legacy_predict(num_prediction, model, close_data, look_back):
+    # the loop predict() in app.py used before forecasting.py
+    prediction_list = close_data[-look_back:]
+    for _ in range(num_prediction):
+        x = prediction_list[-look_back:]
+        x = x.reshape((1, look_back, 1))
+        out = model.predict(x, verbose=0)[0][0]
+        prediction_list = np.append(prediction_list, out)
+    return prediction_list[look_back:]
+
+
+def build_model(look_back, outputs=1):
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dense
+    lstm_model = Sequential()
+    lstm_model.add(LSTM(10, activation='relu', input_shape=(look_back,1)))
+    lstm_model.add(Dense(outputs))
+    return lstm_model
+
+
+def timed(fn, repeat):
+    fn()  # warm up / trace
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - start) / repeat, out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--look-back', type=int, default=15)
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--paths', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from forecasting import recursive_forecast, direct_forecast, monte_carlo_forecast
+    rng = np.random.default_rng(0)
+    series = rng.random((args.batch, 500)).astype(np.float32)
+    model = build_model(args.look_back)
+    direct_model = build_model(args.look_back, args.steps)
+
+    legacy, expected = timed(lambda: legacy_predict(args.steps, model, series[0], args.look_back), 1)
+    single, got = timed(lambda: recursive_forecast(model, series[0], args.look_back, args.steps), args.repeat)
+    batched, _ = timed(lambda: recursive_forecast(model, series, args.look_back, args.steps), args.repeat)
+    direct, _ = timed(lambda: direct_forecast(direct_model, series, args.look_back), args.repeat)
+    residuals = rng.normal(0, 0.01, 500)
+    monte_carlo, _ = timed(lambda: monte_carlo_forecast(model, series[0], args.look_back, args.steps, residuals,
+                                                        args.paths), args.repeat)
+
+    print('max abs difference vs legacy loop : {:.2e}'.format(np.abs(expected - got).max()))
+    print('legacy loop, 1 series            : {:9.2f} ms'.format(legacy * 1e3))
+    print('recursive, 1 series              : {:9.2f} ms ({:.0f}x)'.format(single * 1e3, legacy / single))
+    print('recursive, {} series            : {:9.2f} ms ({:.3f} ms / series)'.format(
+        args.batch, batched * 1e3, batched * 1e3 / args.batch))
+    print('direct, {} series               : {:9.2f} ms ({:.3f} ms / series)'.format(
+        args.batch, direct * 1e3, direct * 1e3 / args.batch))
+    print('monte carlo, {} paths          : {:9.2f} ms ({:.1f} legacy model.predict calls)'.format(
+        args.paths, monte_carlo * 1e3, monte_carlo / (legacy / args.steps)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+'''
+Accuracy against compute cost of the forecasters in forecasters.py.
+Each model is fitted at a number of walk-forward origins of one price series
+and forecasts the next --horizon closes; the table reports the mean fit and
+predict time and the MAE / RMSE / MAPE of those forecasts over all origins.
+Uses a synthetic random walk unless --fixture points at a csv with a Close
+column (e.g. AAPL.csv).
+Run from the repository root with: python -m benchmarks.forecasters
+'''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixture', help='csv file with a Close column, e.g. AAPL.csv')
+    parser.add_argument('--bars', type=int, default=3000)
+    parser.add_argument('--origins', type=int, default=5)
+    parser.add_argument('--horizon', type=int, default=30)
+    parser.add_argument('--models', nargs='+', default=['naive', 'ets', 'arima', 'lstm'])
+    parser.add_argument('--epochs', type=int, default=5, help='LSTM epochs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    from backtest import walk_forward_origins
+    from forecasters import make_forecaster
+    if args.fixture:
+        close = pd.read_csv(args.fixture)['Close'].values.astype(np.float64)
+    else:
+        rng = np.random.default_rng(args.seed)
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, args.bars)))
+    step = max(args.horizon, (len(close) // 2) // args.origins)
+    folds = walk_forward_origins(len(close), len(close) - args.horizon - step * (args.origins - 1),
+                                 args.horizon, step)
+
+    print('{:8} {:>10} {:>11} {:>10} {:>10} {:>8}'.format('model', 'fit s', 'predict s', 'MAE', 'RMSE', 'MAPE'))
+    for name in args.models:
+        params = {'epochs': args.epochs} if name == 'lstm' else {}
+        fit_s, predict_s, errors, actuals = [], [], [], []
+        for _, origin, end in folds:
+            start = time.perf_counter()
+            forecaster = make_forecaster(name, **params).fit(close[:origin])
+            fit_s.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            forecast = forecaster.predict(end - origin)
+            predict_s.append(time.perf_counter() - start)
+            errors.append(forecast - close[origin:end])
+            actuals.append(close[origin:end])
+        errors, actuals = np.concatenate(errors), np.concatenate(actuals)
+        # the first fit also pays for imports, report the median
+        print('{:8} {:10.3f} {:11.4f} {:10.3f} {:10.3f} {:7.2%}'.format(
+            name, np.median(fit_s), np.median(predict_s), np.mean(np.abs(errors)),
+            np.sqrt(np.mean(errors ** 2)), np.mean(np.abs(errors) / actuals)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import tempfile
+import argparse
+import subprocess
+
+import numpy as np
+
+'''
+Serving cost of a train_model network with keras against its numpy_lstm export:
+max abs output difference, then cold-start wall time and peak RSS of a fresh
+process that loads the model and runs one 30 day forecast.
+Run from the repository root with: python -m benchmarks.numpy_inference
+'''
+
+SERVE = '''
+import json, sys, time
+start = time.perf_counter()
+import numpy as np
+from forecasting import recursive_forecast
+if sys.argv[1] == 'numpy':
+    from numpy_lstm import NumpyModel
+    model = NumpyModel.load(sys.argv[2] + '.npz')
+else:
+    from keras.models import load_model
+    model = load_model(sys.argv[2] + '.h5', compile=False)
+recursive_forecast(model, np.random.rand(500), 15, 30)
+# VmHWM, ru_maxrss would include the parent's peak inherited through fork
+with open('/proc/self/status') as f:
+    peak = [int(line.split()[1]) for line in f if line.startswith('VmHWM')][0]
+print(json.dumps({'seconds': time.perf_counter() - start, 'max_rss_mb': peak / 1024}))
+'''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--look-back', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    from numpy_lstm import export_model, NumpyModel
+    from benchmarks.forecast import build_model
+    model = build_model(args.look_back)
+    x = np.random.default_rng(0).random((1000, args.look_back, 1)).astype(np.float32)
+    with tempfile.TemporaryDirectory() as folder:
+        base = os.path.join(folder, 'model')
+        model.save(base + '.h5')
+        export_model(model, base + '.npz')
+        error = np.abs(model.predict(x, verbose=0) - NumpyModel.load(base + '.npz').predict(x)).max()
+        print('max abs difference : {:.2e}'.format(error))
+        for backend in ('keras', 'numpy'):
+            out = subprocess.run([sys.executable, '-c', SERVE, backend, base],
+                                 capture_output=True, text=True, check=True)
+            stats = json.loads(out.stdout.strip().splitlines()[-1])
+            print('{:5} : cold forecast {:6.2f} s, peak RSS {:7.1f} MB'.format(
+                backend, stats['seconds'], stats['max_rss_mb']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
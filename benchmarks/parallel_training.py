@@ -0,0 +1,36 @@
+import os
+import sys
+import argparse
+
+'''
+Scaling curve of parallel_training: training throughput (windows per second)
+of the dashboard network with 1, 2, 4, ... cores, one replica per core, each
+point measured in a fresh process pinned to that many cores. The first row is
+the old setup (train_model's batch of 20, one replica, default threads) on all
+the cores for reference.
+Run from the repository root with: python -m benchmarks.parallel_training
+'''
+
+
+def main(argv=None):
+    from parallel_training import DEFAULT_SETUP, probe_process
+    cores = len(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=256, help='global batch, split across the replicas')
+    parser.add_argument('--cores', type=int, nargs='+',
+                        default=sorted({1 << i for i in range(cores.bit_length())} | {cores}))
+    parser.add_argument('--steps', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    old = probe_process(dict(DEFAULT_SETUP, batch_size=20), steps=args.steps)
+    print('{:>6} {:>9} {:>6} {:>14} {:>8}'.format('cores', 'replicas', 'batch', 'windows/s', 'speedup'))
+    print('{:>6} {:>9} {:>6} {:14.0f} {:>8}'.format(cores, 1, 20, old, '(old)'))
+    base = None
+    for n in args.cores:
+        rate = probe_process(dict(DEFAULT_SETUP, replicas=n, batch_size=args.batch_size), cores=n, steps=args.steps)
+        base = base or rate
+        print('{:>6} {:>9} {:>6} {:14.0f} {:7.2f}x'.format(n, n, args.batch_size, rate, rate / base))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+import numpy as np
+
+'''
+Stage by stage benchmark of the app2.py forecast pipeline.
+Every stage (download_and_process_data, split_data, scale_data,
+sequence_to_supervised, train_model, plot_train_test_graph, predicting,
+plot_future_prediction) is timed on synthetic price series of the requested
+lengths, or on a fixture csv such as AAPL.csv, read through a CSV price source
+so no network is needed. For each stage the wall time, peak RSS, peak Python
+heap and throughput (bars / s) are reported and written to a json file;
+--compare fails when a stage got slower than a previous result file by more
+than --threshold.
+Run from the repository root with:
+    python -m benchmarks.pipeline --lengths 1000 10000 100000 --output bench.json
+    python -m benchmarks.pipeline --compare bench.json
+'''
+
+STAGES = ['download_and_process_data', 'split_data', 'scale_data', 'sequence_to_supervised',
+          'train_model', 'plot_train_test_graph', 'predicting', 'plot_future_prediction']
+
+
+def write_synthetic(folder, ticker, length, seed):
+    import pandas as pd
+    # hourly bars, 100k of them still fit in the 15 years app2.py downloads
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today().floor('h'), periods=length, freq='h')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, length)))
+    df = pd.DataFrame({'Date': dates, 'Open': close, 'High': close * 1.01, 'Low': close * 0.99,
+                       'Close': close, 'Adj Close': close, 'Volume': rng.integers(1e5, 1e6, length)})
+    df.to_csv(os.path.join(folder, ticker + '.csv'), index=False)
+
+
+def reset_peak_rss():
+    # writing 5 to clear_refs resets VmHWM (linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    with open('/proc/self/status') as f:
+        return [int(line.split()[1]) for line in f if line.startswith('VmHWM')][0] / 1024
+
+
+class StageTimer:
+    def __init__(self, bars):
+        self.bars = bars
+        self.stages = {}
+
+    def run(self, name, fn, *args):
+        exact_rss = reset_peak_rss()
+        tracemalloc.start()
+        start = time.perf_counter()
+        out = fn(*args)
+        seconds = time.perf_counter() - start
+        py_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stages[name] = {'seconds': seconds, 'bars_per_s': self.bars / seconds if seconds else None,
+                             'peak_rss_mb': peak_rss_mb() if exact_rss else None,
+                             'py_peak_mb': py_peak / 2 ** 20}
+        return out
+
+
+def run_pipeline(ticker, bars, look_back, epochs):
+    import app2
+    timer = StageTimer(bars)
+    start = time.perf_counter()
+    df, close_data, info = timer.run('download_and_process_data', app2.download_and_process_data, ticker)
+    timer.bars = len(df)
+    close_train, close_test, date_train, date_test = timer.run('split_data', app2.split_data, close_data, df)
+    close_train, close_test = timer.run('scale_data', app2.scale_data, close_train, close_test)
+    train_generator, test_generator = timer.run(
+        'sequence_to_supervised', app2.sequence_to_supervised, look_back, close_train, close_test)
+    model = timer.run('train_model', app2.train_model, look_back, train_generator, epochs)
+    timer.run('plot_train_test_graph', app2.plot_train_test_graph,
+              ticker, model, test_generator, close_train, close_test, date_train, date_test)
+    close_data, forecast, forecast_dates = timer.run('predicting', app2.predicting, close_data, model, look_back, df)
+    timer.run('plot_future_prediction', app2.plot_future_prediction,
+              model, test_generator, close_train, close_test, df, forecast_dates, forecast)
+    total = time.perf_counter() - start
+    return {'bars': len(df), 'stages': timer.stages,
+            'total': {'seconds': total, 'bars_per_s': len(df) / total}}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    import tensorflow as tf
+    return {'commit': commit or None, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'tensorflow': tf.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+def compare(current, baseline, threshold):
+    previous = {(run['source'], run['bars']): run for run in baseline['runs']}
+    regressions = []
+    for run in current['runs']:
+        old = previous.get((run['source'], run['bars']))
+        if old is None:
+            continue
+        for name in STAGES + ['total']:
+            new_s = (run['total'] if name == 'total' else run['stages'][name])['seconds']
+            old_s = (old['total'] if name == 'total' else old['stages'][name])['seconds']
+            ratio = new_s / old_s if old_s else float('inf')
+            flag = ratio > 1 + threshold
+            print('{:>8} bars {:26} {:9.3f} s -> {:9.3f} s  x{:5.2f}{}'.format(
+                run['bars'], name, old_s, new_s, ratio, '  REGRESSION' if flag else ''))
+            if flag:
+                regressions.append((run['bars'], name))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--fixture', help='csv file with Date and Close columns, e.g. AAPL.csv')
+    parser.add_argument('--look-back', type=int, default=15)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='previous results json to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown per stage, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    import keras
+    import price_store
+    import ticker_info
+    keras.utils.set_random_seed(args.seed)
+    report = dict(environment(), epochs=args.epochs, look_back=args.look_back, runs=[])
+    with tempfile.TemporaryDirectory() as folder:
+        cases = [('synthetic', 'SYN{}'.format(n), n) for n in args.lengths]
+        if args.fixture:
+            import shutil
+            shutil.copy(args.fixture, os.path.join(folder, 'FIXTURE.csv'))
+            cases.append((os.path.basename(args.fixture), 'FIXTURE', None))
+        # one discarded small run first, so imports and tracing do not land in the first case
+        cases.insert(0, ('warmup', 'WARMUP', 500))
+        for source, ticker, length in cases:
+            if length is not None:
+                write_synthetic(folder, ticker, length, args.seed)
+            # a fresh store per case, so the download stage is always a cold read
+            price_store._default_store = price_store.PriceStore(
+                price_store.CSVSource(folder), os.path.join(folder, 'store', ticker))
+            ticker_info._default_info_store = ticker_info.TickerInfoStore(
+                ticker_info.JSONInfoSource(folder), os.path.join(folder, 'info', ticker))
+            run = dict(run_pipeline(ticker, length or 0, args.look_back, args.epochs), source=source)
+            if source == 'warmup':
+                continue
+            report['runs'].append(run)
+            print('{} {} bars : {:.2f} s end to end, {:.0f} bars / s'.format(
+                source, run['bars'], run['total']['seconds'], run['total']['bars_per_s']))
+            for name in STAGES:
+                stage = run['stages'][name]
+                print('    {:26} {:9.3f} s  peak RSS {:>8} MB  python heap {:8.1f} MB'.format(
+                    name, stage['seconds'],
+                    '-' if stage['peak_rss_mb'] is None else '{:.1f}'.format(stage['peak_rss_mb']),
+                    stage['py_peak_mb']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print('{} stage(s) slower than {} by more than {:.0%}'.format(
+                len(regressions), args.compare, args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+import numpy as np
+
+'''
+Accuracy and serving cost of the notebook's create_model(hu=512) network in
+keras float32 against its numpy_lstm exports at float32, float16 and int8:
+prediction error on held-out windows of a random walk (and the difference to
+the keras output), file size, load time, resident weight memory, RSS growth
+with --models copies loaded at once, and the latency of one prediction and of
+a 30 day forecast.
+Run from the repository root with: python -m benchmarks.quantization
+'''
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        return [int(line.split()[1]) for line in f if line.startswith('VmRSS')][0] / 1024
+
+
+def notebook_model(units, look_back):
+    # create_model of the notebook, one feature
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dense, Input
+    model = Sequential([Input((look_back, 1)), LSTM(units, activation='relu', name='LSTM'), Dense(1, name='Output')])
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--units', type=int, default=512)
+    parser.add_argument('--look-back', type=int, default=40)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--models', type=int, default=100, help='copies loaded together for the RSS column')
+    args = parser.parse_args(argv)
+
+    import keras
+    from keras.models import load_model
+    from numpy_lstm import PRECISIONS, NumpyModel, export_model
+    from forecasting import recursive_forecast
+    from windowing import make_windows
+    keras.utils.set_random_seed(0)
+    walk = np.cumsum(np.random.default_rng(0).normal(0, 1, 3000))
+    series = (walk - walk.min()) / (walk.max() - walk.min())
+    split = int(len(series) * 0.8)
+    x_train, y_train = make_windows(series[:split], args.look_back)
+    x_test, y_test = make_windows(series[split - args.look_back:], args.look_back)
+    x_test = x_test.astype(np.float32)
+    model = notebook_model(args.units, args.look_back)
+    model.fit(x_train, y_train, batch_size=32, epochs=args.epochs, verbose=0)
+    reference = model.predict(x_test, verbose=0)[:, 0]
+
+    print('{} units, look_back {}, {} parameters, test RMSE in scaled units'.format(
+        args.units, args.look_back, model.count_params()))
+    print('{:8} {:>10} {:>10} {:>8} {:>9} {:>9} {:>12} {:>10} {:>11}'.format(
+        'model', 'test rmse', 'max diff', 'file KB', 'load ms', 'weights', 'RSS x{}'.format(args.models),
+        'predict ms', 'forecast ms'))
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {'keras': os.path.join(folder, 'model.h5')}
+        model.save(paths['keras'])
+        for precision in PRECISIONS:
+            paths[precision] = os.path.join(folder, '{}.npz'.format(precision))
+            export_model(model, paths[precision], precision)
+
+        for name, path in paths.items():
+            load = (lambda: load_model(path, compile=False)) if name == 'keras' else (lambda: NumpyModel.load(path))
+            served = load()
+            out = np.asarray(served(x_test, training=False))[:, 0]
+            weights = 4 * served.count_params() if name == 'keras' else served.nbytes
+            before = rss_mb()
+            resident = [load() for _ in range(args.models)]
+            grown = rss_mb() - before
+            del resident
+            print('{:8} {:10.5f} {:10.2e} {:8.0f} {:9.1f} {:7.0f}KB {:10.0f}MB {:10.2f} {:11.2f}'.format(
+                name, np.sqrt(np.mean((out - y_test) ** 2)), np.abs(out - reference).max(),
+                os.path.getsize(path) / 1024, 1000 * timed(load, 3), weights / 1024, grown,
+                1000 * timed(lambda: served(x_test[:1], training=False), 20),
+                1000 * timed(lambda: recursive_forecast(served, series, args.look_back, 30), 5)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+'''
+Startup cost of the Dash apps.
+For each app module a fresh interpreter imports it and reports the wall time and
+peak RSS; the "eager" rows also import the ML / data stack first, which is what
+every worker paid before those imports were made lazy.
+With --gunicorn N the app is additionally served by gunicorn --preload with N
+workers and the proportional set size (PSS) of master and workers is summed.
+Run from the repository root with: python -m benchmarks.startup
+'''
+
+HEAVY = ['pandas', 'numpy', 'tensorflow', 'keras', 'yfinance', 'sklearn.preprocessing', 'plotly.graph_objs']
+
+IMPORT = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+for name in sys.argv[2:]:
+    importlib.import_module(name)
+importlib.import_module(sys.argv[1])
+with open('/proc/self/status') as f:
+    peak = [int(line.split()[1]) for line in f if line.startswith('VmHWM')][0]
+print(json.dumps({'seconds': time.perf_counter() - start, 'max_rss_mb': peak / 1024}))
+'''
+
+
+def measure_import(module, preload=()):
+    out = subprocess.run([sys.executable, '-c', IMPORT, module] + list(preload),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def pss_mb(pid):
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        return [int(line.split()[1]) for line in f if line.startswith('Pss:')][0] / 1024
+
+
+def children(pid):
+    with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure_gunicorn(module, workers, port, timeout=120):
+    import urllib.request
+    start = time.perf_counter()
+    proc = subprocess.Popen(['gunicorn', '--preload', '-w', str(workers), '-b', '127.0.0.1:{}'.format(port),
+                             '{}:server'.format(module)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError('gunicorn did not come up within {} s'.format(timeout))
+            try:
+                urllib.request.urlopen('http://127.0.0.1:{}/'.format(port), timeout=1)
+                break
+            except OSError:
+                time.sleep(0.2)
+        ready = time.perf_counter() - start
+        pids = [proc.pid] + children(proc.pid)
+        return {'seconds_to_first_response': ready, 'processes': len(pids),
+                'total_pss_mb': sum(pss_mb(pid) for pid in pids)}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=['app', 'app2'])
+    parser.add_argument('--gunicorn', type=int, default=0, help='number of gunicorn workers, 0 to skip')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='also write the report to this json file')
+    args = parser.parse_args(argv)
+
+    report = {}
+    for module in args.modules:
+        report[module] = {'lazy': measure_import(module), 'eager': measure_import(module, HEAVY)}
+        if args.gunicorn:
+            report[module]['gunicorn'] = measure_gunicorn(module, args.gunicorn, args.port)
+        for mode in ('lazy', 'eager'):
+            stats = report[module][mode]
+            print('{:6} {:5} : import {:6.2f} s, peak RSS {:7.1f} MB'.format(
+                module, mode, stats['seconds'], stats['max_rss_mb']))
+        if args.gunicorn:
+            stats = report[module]['gunicorn']
+            print('{:6} gunicorn --preload -w {} : first response after {:.2f} s, total PSS {:.1f} MB'.format(
+                module, args.gunicorn, stats['seconds_to_first_response'], stats['total_pss_mb']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
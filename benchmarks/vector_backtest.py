@@ -0,0 +1,81 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+'''
+Parameter sweep of the BuyHoldSell strategy: vector_backtest.run_grid against a
+bar by bar loop with the same rules (the way an event driven backtester runs
+it), on a synthetic price series and a noisy prediction of it. The loop checks
+the vectorized equity and trade counts on a sample of the grid, then both are
+timed on the full grid.
+Run from the repository root with: python -m benchmarks.vector_backtest
+'''
+
+
+def loop_backtest(actual, predicted, threshold, commission, rule, opens=None, cash=10_000):
+    equity, trades = [], 0
+    state, bought, position, entry, base = 0, False, 0, 0.0, cash
+    for t in range(len(actual)):
+        if opens is not None:
+            # yesterday's decision, filled at today's open
+            wanted, fill = state, opens[t]
+        signal = predicted[t] / actual[t - 1] - 1 if t > 0 else 0.0
+        if signal > threshold:
+            state, bought = 1, True
+        elif signal < -threshold and bought:
+            state = -1 if rule == 'long_short' else 0
+        if opens is None:
+            wanted, fill = state, actual[t]
+        if wanted != position:
+            if position != 0:
+                base = base * (1 - commission) * (1 + position * (fill / entry - 1)) * (1 - commission)
+            position, entry = wanted, fill
+            trades += position != 0
+        equity.append(base if position == 0 else
+                      base * (1 - commission) * (1 + position * (actual[t] / entry - 1)))
+    return np.asarray(equity), trades
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bars', type=int, default=5000)
+    parser.add_argument('--thresholds', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import vector_backtest
+    rng = np.random.default_rng(args.seed)
+    actual = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, args.bars)))
+    predicted = actual * (1 + rng.normal(0, 0.02, args.bars))
+    opens = actual * (1 + rng.normal(0, 0.002, args.bars))
+    thresholds = np.linspace(0, 0.05, args.thresholds)
+    commissions = [0, 0.001, 0.002]
+    rules = list(vector_backtest.RULES)
+
+    for name, o in (('close fills', None), ('next open fills', opens)):
+        result = vector_backtest.run_grid(actual, predicted, thresholds[::50], commissions, rules, o)
+        worst = 0.0
+        for row in result.itertuples(index=False):
+            equity, trades = loop_backtest(actual, predicted, row.threshold, row.commission, row.rule, o)
+            worst = max(worst, abs(equity[-1] - row[3]) / equity[-1])
+            assert trades == row[8], (row, trades)
+        print('{}: {} combinations match the loop, max relative equity difference {:.2e}'.format(
+            name, len(result), worst))
+
+    n = args.thresholds * len(commissions) * len(rules)
+    start = time.perf_counter()
+    vector_backtest.run_grid(actual, predicted, thresholds, commissions, rules)
+    vector_s = time.perf_counter() - start
+    start = time.perf_counter()
+    sample = max(1, n // 50)
+    for threshold in thresholds[:sample]:
+        loop_backtest(actual, predicted, threshold, 0.002, 'long_short')
+    loop_s = (time.perf_counter() - start) / sample * n
+    print('{} combinations x {} bars : vectorized {:.2f} s, bar by bar {:.1f} s (extrapolated from {}), x{:.0f}'.format(
+        n, args.bars, vector_s, loop_s, sample, loop_s / vector_s))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
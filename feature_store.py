@@ -0,0 +1,157 @@
+import os
+import glob
+import json
+import time
+import hashlib
+
+import numpy as np
+
+'''
+Memory-mapped feature store.
+A ticker's features (the target column first, then e.g. Volume, Open, High,
+Low) are min-max scaled with the min / max of the first train_fraction of the
+bars, like the notebook's MinMaxScaler, or kept as they are with scaled=False
+(app.py trains on raw closes), and written once as a float32 .npy
+matrix under FEATURE_DIR, next to the dates and a json file holding the scaler
+parameters. Readers map the matrix read-only (np.load mmap_mode='r'), so every
+process that opens the same ticker shares one page-cached copy of it, and
+windows are strided views (make_windows) or batches gathered on demand
+(make_dataset in_memory=False) rather than an X_train built in memory:
+
+    features = default_feature_store().get('AAPL', ['Volume'])
+    model.fit(features.dataset(look_back, stop=features.train_end, shuffle=True))
+    x, y = features.windows(look_back, start=features.train_end - look_back)
+    features.inverse_transform(model.predict(x))
+
+A matrix is rebuilt when the price store has bars it does not cover. Every
+build gets new file names, the json file naming the current ones is replaced
+last, so a reader never maps a half written or mismatched matrix.
+'''
+
+FEATURE_DIR = os.environ.get('FEATURE_DIR', os.path.join('cache', 'features'))
+
+
+def _target(df, target):
+    # recent yfinance versions only return adjusted prices, without an 'Adj Close' column
+    if target not in df.columns and target == 'Adj Close':
+        return 'Close'
+    return target
+
+
+class FeatureSet:
+    def __init__(self, directory, meta):
+        self.meta = meta
+        self.columns = meta['columns']
+        self.train_end = meta['train_end']
+        self.data_min = np.asarray(meta['data_min'])
+        self.data_max = np.asarray(meta['data_max'])
+        self.data = np.load(os.path.join(directory, meta['data']), mmap_mode='r')
+        self.dates = np.load(os.path.join(directory, meta['dates']), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.data)
+
+    def windows(self, look_back, horizon=1, start=0, stop=None):
+        from windowing import make_windows
+        return make_windows(self.data[start:stop], look_back, horizon)
+
+    def dataset(self, look_back, batch_size=256, horizon=1, start=0, stop=None, shuffle=False, seed=None):
+        from windowing import make_dataset
+        return make_dataset(self.data[start:stop], look_back, batch_size, horizon, shuffle=shuffle, seed=seed,
+                            in_memory=False)
+
+    def inverse_transform(self, values, column=0):
+        # scaled values of one column (the target by default) back to prices
+        values = np.asarray(values, dtype=np.float64)
+        scale = self.data_max[column] - self.data_min[column]
+        return values * (scale if scale else 1.0) + self.data_min[column]
+
+
+class FeatureStore:
+    def __init__(self, directory=FEATURE_DIR, prices=None):
+        self.directory = directory
+        self.prices = prices
+
+    def _key(self, ticker, columns, train_fraction, scaled):
+        from price_store import ticker_key
+        spec = json.dumps([columns, train_fraction] + ([] if scaled else ['raw'])).encode()
+        return '{}-{}'.format(ticker_key(ticker), hashlib.sha1(spec).hexdigest()[:10])
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self.directory, key + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def build(self, key, df, columns, train_fraction, scaled=True):
+        os.makedirs(self.directory, exist_ok=True)
+        values = df[columns].to_numpy(dtype=np.float64)
+        train_end = int(len(values) * train_fraction)
+        if scaled:
+            data_min = values[:max(train_end, 1)].min(axis=0)
+            data_max = values[:max(train_end, 1)].max(axis=0)
+        else:
+            # the identity transform, inverse_transform then returns the values unchanged
+            data_min, data_max = np.zeros(len(columns)), np.ones(len(columns))
+        scale = np.where(data_max > data_min, data_max - data_min, 1.0)
+        version = '{:x}'.format(time.time_ns())
+        data_name, dates_name = '{}.{}.npy'.format(key, version), '{}.{}.dates.npy'.format(key, version)
+
+        tmp = os.path.join(self.directory, '{}.{}.tmp.npy'.format(data_name, os.getpid()))
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=values.shape)
+        out[:] = (values - data_min) / scale
+        out.flush()
+        del out
+        os.replace(tmp, os.path.join(self.directory, data_name))
+        tmp = os.path.join(self.directory, '{}.{}.tmp.npy'.format(dates_name, os.getpid()))
+        np.save(tmp, df.index.values.astype('datetime64[ns]'))
+        os.replace(tmp, os.path.join(self.directory, dates_name))
+
+        meta = {'columns': columns, 'train_fraction': train_fraction, 'train_end': train_end,
+                'data_min': data_min.tolist(), 'data_max': data_max.tolist(),
+                'rows': len(values), 'end_date': df.index[-1].isoformat(),
+                'data': data_name, 'dates': dates_name, 'built_at': time.time()}
+        meta_path = os.path.join(self.directory, key + '.json')
+        tmp = '{}.{}.tmp'.format(meta_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+        # earlier builds stay readable by whoever still maps them, unlinking only drops the name
+        for path in glob.glob(os.path.join(self.directory, key + '.*.npy')):
+            if os.path.basename(path) not in (data_name, dates_name) and '.tmp.' not in path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return meta
+
+    def get(self, ticker, features=(), target='Adj Close', train_fraction=0.8, period='max', scaled=True):
+        import metrics
+        from price_store import default_store
+        df = (self.prices or default_store()).history(ticker, period=period)
+        if len(df) == 0:
+            raise ValueError('no price history for {}'.format(ticker))
+        columns = [_target(df, target)] + [c for c in features if c != target]
+        key = self._key(ticker, columns, train_fraction, scaled)
+        meta = self._read_meta(key)
+        if meta is None or meta['rows'] != len(df) or meta['end_date'] != df.index[-1].isoformat():
+            metrics.inc('feature_store_requests_total', result='build')
+            meta = self.build(key, df, columns, train_fraction, scaled)
+        else:
+            metrics.inc('feature_store_requests_total', result='hit')
+        try:
+            return FeatureSet(self.directory, meta)
+        except FileNotFoundError:
+            # a concurrent build pruned the files this meta names
+            return FeatureSet(self.directory, self.build(key, df, columns, train_fraction, scaled))
+
+
+_default_feature_store = None
+
+def default_feature_store():
+    global _default_feature_store
+    if _default_feature_store is None:
+        _default_feature_store = FeatureStore()
+    return _default_feature_store
@@ -0,0 +1,120 @@
+import os
+import base64
+
+import numpy as np
+
+'''
+Figure building for the dashboard.
+The plotting functions describe a figure as a spec: full-resolution traces and
+a layout. render() turns a spec into a plotly figure dict for a given number of
+points, optionally restricted to a zoomed x range: each trace is downsampled
+(LTTB by default, or min / max per bucket) and, with FIGURE_ENCODING=typed,
+sent as base64 typed arrays instead of json number lists. Dates travel as
+epoch milliseconds, so date axes are declared with type 'date'.
+'''
+
+FIGURE_POINTS = int(os.environ.get('FIGURE_POINTS', 2000))
+FIGURE_METHOD = os.environ.get('FIGURE_METHOD', 'lttb')
+FIGURE_ENCODING = os.environ.get('FIGURE_ENCODING', 'typed')
+
+
+def figure_spec(traces, layout):
+    return {'traces': traces, 'layout': layout}
+
+
+def to_epoch_ms(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or x.dtype == object:
+        return x.astype('datetime64[ns]').astype(np.int64) / 1e6
+    return x.astype(np.float64)
+
+
+def lttb(x, y, n_out):
+    # largest triangle three buckets, returns the indices of the kept points
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # the average of the bucket after each one does not depend on the chosen points
+    starts = np.append(edges[1:-1], n - 1)
+    counts = np.diff(np.append(starts, n))
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+    index = np.empty(n_out, dtype=np.int64)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+
+def minmax(x, y, n_out):
+    # the lowest and highest point of every bucket, in x order
+    n = len(x)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(np.int64)
+    index = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            low, high = start + np.argmin(y[start:end]), start + np.argmax(y[start:end])
+            index.extend(sorted({low, high}))
+    return np.asarray(index, dtype=np.int64)
+
+
+def typed_array(values, dtype):
+    values = np.ascontiguousarray(values, dtype=dtype)
+    return {'dtype': np.dtype(dtype).str.lstrip('<|'), 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+def render_trace(trace, n_points, x_range=None, method=FIGURE_METHOD, encoding=FIGURE_ENCODING):
+    x = to_epoch_ms(trace['x'])
+    y = np.asarray(trace['y'], dtype=np.float64).reshape((-1))
+    # like plotly, pair points up to the shorter of x and y
+    n = min(len(x), len(y))
+    x, y = x[:n], y[:n]
+    keep = np.isfinite(x) & np.isfinite(y)
+    if x_range is not None:
+        inside = (x >= x_range[0]) & (x <= x_range[1])
+        # one point past either edge so the line reaches the border of the plot
+        grown = inside.copy()
+        grown[1:] |= inside[:-1]
+        grown[:-1] |= inside[1:]
+        keep &= grown
+    x, y = x[keep], y[keep]
+    index = (lttb if method == 'lttb' else minmax)(x, y, n_points)
+    x, y = x[index], y[index]
+    out = {k: v for k, v in trace.items() if k not in ('x', 'y')}
+    out.setdefault('type', 'scatter')
+    if encoding == 'typed':
+        out['x'], out['y'] = typed_array(x, '<f8'), typed_array(y, '<f4')
+    else:
+        out['x'], out['y'] = x.tolist(), y.tolist()
+    return out
+
+
+def parse_x_range(relayout):
+    # relayoutData of a zoom holds xaxis.range[0] / [1], or xaxis.range as a list
+    import pandas as pd
+    if not relayout:
+        return None
+    if 'xaxis.range[0]' in relayout:
+        bounds = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        bounds = relayout['xaxis.range']
+    else:
+        return None
+    return tuple(pd.Timestamp(b).value / 1e6 if isinstance(b, str) else float(b) for b in bounds)
+
+
+def render(spec, n_points=FIGURE_POINTS, x_range=None, uirevision=None, encoding=FIGURE_ENCODING):
+    layout = dict(spec['layout'])
+    layout['xaxis'] = dict(layout.get('xaxis', {}), type='date')
+    if uirevision is not None:
+        # keeps the user's zoom when the figure is swapped for a full-resolution one
+        layout['uirevision'] = uirevision
+    traces = [render_trace(trace, n_points, x_range, encoding=encoding) for trace in spec['traces']]
+    return {'data': traces, 'layout': layout}
@@ -0,0 +1,148 @@
+import os
+import pickle
+
+import numpy as np
+
+'''
+Forecasters behind one interface.
+Every forecaster is fitted on a series of closes and forecasts the next `steps`
+closes after it:
+
+    forecaster = make_forecaster('ets').fit(close)
+    forecaster.predict(30)
+    forecaster.save(path); Forecaster.load(path)
+
+'lstm' is the app2.py pipeline (MinMaxScaler, train_model, recursive rollout).
+'naive' (last close plus the average drift), 'arima' and 'ets' (statsmodels)
+are baselines that fit in milliseconds; the statistical ones only look at the
+last BASELINE_WINDOW bars. The dashboard shows the BASELINE_MODEL forecast
+while the LSTM trains.
+'''
+
+BASELINE_MODEL = os.environ.get('BASELINE_MODEL', 'ets')
+BASELINE_WINDOW = int(os.environ.get('BASELINE_WINDOW', 500))
+
+
+def _series(close):
+    return np.asarray(close, dtype=np.float64).reshape((-1))
+
+
+class Forecaster:
+    name = None
+
+    def fit(self, close):
+        raise NotImplementedError
+
+    def predict(self, steps):
+        raise NotImplementedError
+
+    def save(self, path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            forecaster = pickle.load(f)
+        if hasattr(forecaster, '_restore'):
+            forecaster._restore(path)
+        return forecaster
+
+
+class NaiveDriftForecaster(Forecaster):
+    name = 'naive'
+
+    def __init__(self, window=None):
+        self.window = window
+
+    def fit(self, close):
+        close = _series(close)[-self.window:] if self.window else _series(close)
+        self.last = close[-1]
+        self.drift = (close[-1] - close[0]) / max(len(close) - 1, 1)
+        return self
+
+    def predict(self, steps):
+        return self.last + self.drift * np.arange(1, steps + 1)
+
+
+class ARIMAForecaster(Forecaster):
+    name = 'arima'
+
+    def __init__(self, order=(1, 1, 1), window=BASELINE_WINDOW):
+        self.order = order
+        self.window = window
+
+    def fit(self, close):
+        from statsmodels.tsa.arima.model import ARIMA
+        close = _series(close)[-self.window:]
+        self.results = ARIMA(close, order=self.order, trend='t').fit()
+        return self
+
+    def predict(self, steps):
+        return np.asarray(self.results.forecast(int(steps)))
+
+
+class ETSForecaster(Forecaster):
+    name = 'ets'
+
+    def __init__(self, damped=True, window=BASELINE_WINDOW):
+        self.damped = damped
+        self.window = window
+
+    def fit(self, close):
+        from statsmodels.tsa.holtwinters import ExponentialSmoothing
+        close = _series(close)[-self.window:]
+        self.results = ExponentialSmoothing(close, trend='add', damped_trend=self.damped).fit()
+        return self
+
+    def predict(self, steps):
+        return np.asarray(self.results.forecast(int(steps)))
+
+
+class LSTMForecaster(Forecaster):
+    name = 'lstm'
+
+    def __init__(self, look_back=15, epochs=20):
+        self.look_back = look_back
+        self.epochs = epochs
+        self.model = None
+
+    def fit(self, close):
+        import app2
+        from sklearn.preprocessing import MinMaxScaler
+        from windowing import make_dataset
+        close = _series(close).reshape((-1, 1))
+        self.scaler = MinMaxScaler(feature_range=(0,1)).fit(close)
+        self.history = self.scaler.transform(close)[-self.look_back:, 0]
+        self.model = app2.train_model(self.look_back, make_dataset(self.scaler.transform(close), self.look_back,
+                                                                   batch_size=20), self.epochs)
+        return self
+
+    def predict(self, steps):
+        from forecasting import recursive_forecast
+        forecast = recursive_forecast(self.model, self.history, self.look_back, steps)
+        return self.scaler.inverse_transform(np.asarray(forecast).reshape((-1, 1)))[:, 0]
+
+    def save(self, path):
+        # keras models do not pickle, the network goes to <path>.h5 next to the rest
+        model, self.model = self.model, None
+        try:
+            model.save(path + '.h5')
+            Forecaster.save(self, path)
+        finally:
+            self.model = model
+
+    def _restore(self, path):
+        from keras.models import load_model
+        self.model = load_model(path + '.h5', compile=False)
+
+
+FORECASTERS = {cls.name: cls for cls in (NaiveDriftForecaster, ARIMAForecaster, ETSForecaster, LSTMForecaster)}
+
+
+def make_forecaster(name, **params):
+    if name not in FORECASTERS:
+        raise ValueError("Unknown forecaster '{}', expected one of {}".format(name, sorted(FORECASTERS)))
+    return FORECASTERS[name](**params)
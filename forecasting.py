@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+'''
+Forecasting engine.
+recursive_forecast rolls a one-step model forward inside a single tf.function,
+so a 30 day forecast is one compiled call instead of 30 model.predict calls.
+Histories can be a single series (n,) or a batch of series / scenarios (batch, n),
+all of them advance together as one tensor. Models exported to numpy_lstm are
+rolled forward with NumPy instead.
+monte_carlo_forecast turns one history into FORECAST_PATHS stochastic paths by
+adding bootstrapped one-step residuals at every step, and returns quantiles
+of them for prediction intervals.
+direct_forecast uses a model with one output per horizon step (see
+train_direct_model) and needs a single forward pass.
+'''
+
+FORECAST_PATHS = int(os.environ.get('FORECAST_PATHS', 1000))
+
+
+def _windows(history, look_back):
+    history = np.asarray(history, dtype=np.float32)
+    if history.ndim == 2 and history.shape[1] == 1:
+        # a column vector like close_data, not a batch of length-1 series
+        history = history.reshape((-1))
+    single = history.ndim == 1
+    history = np.atleast_2d(history)
+    return np.ascontiguousarray(history[:, -look_back:]), single
+
+
+def _rollout_fn(model, steps, noisy=False):
+    import tensorflow as tf
+    # kept on the model: the rollouts close over it and go away with it
+    if not hasattr(model, '_rollouts'):
+        model._rollouts = {}
+    fns = model._rollouts
+    if (steps, noisy) not in fns:
+        @tf.function
+        def rollout(window, noise):
+            outputs = tf.TensorArray(window.dtype, size=steps)
+            for i in tf.range(steps):
+                # the models in app.py / app2.py may emit several values, the first one is the next close
+                out = model(window[:, :, tf.newaxis], training=False)[:, 0]
+                if noisy:
+                    out = out + noise[:, i]
+                outputs = outputs.write(i, out)
+                window = tf.concat([window[:, 1:], out[:, tf.newaxis]], axis=1)
+            return tf.transpose(outputs.stack())
+        fns[(steps, noisy)] = rollout
+    return fns[(steps, noisy)]
+
+
+def _numpy_rollout(model, window, steps, noise=None):
+    look_back = window.shape[1]
+    # preallocated buffer, step i reads the view buffer[:, i:i+look_back]
+    buffer = np.empty((window.shape[0], look_back + steps), dtype=np.float32)
+    buffer[:, :look_back] = window
+    for i in range(steps):
+        buffer[:, look_back + i] = model(buffer[:, i:i + look_back, np.newaxis])[:, 0]
+        if noise is not None:
+            buffer[:, look_back + i] += noise[:, i]
+    return buffer[:, look_back:]
+
+
+def recursive_forecast(model, history, look_back, steps, noise=None):
+    # noise : optional (batch, steps) array added to every step before it is fed back
+    from numpy_lstm import NumpyModel
+    window, single = _windows(history, look_back)
+    # a numpy integer would trace a rollout with an int64 loop counter
+    steps = int(steps)
+    if noise is not None:
+        noise = np.asarray(noise, dtype=np.float32)
+    if isinstance(model, NumpyModel):
+        forecast = _numpy_rollout(model.widened(), window, steps, noise)
+    else:
+        empty = np.zeros((0, steps), dtype=np.float32)
+        forecast = _rollout_fn(model, steps, noise is not None)(window, empty if noise is None else noise).numpy()
+    return forecast[0] if single else forecast
+
+
+def one_step_residuals(model, data, look_back):
+    # actual minus predicted next value over every window of data, e.g. the test split
+    from windowing import make_windows
+    x, y = make_windows(np.asarray(data, dtype=np.float32).reshape((-1)), look_back)
+    prediction = np.asarray(model(x, training=False))[:, 0]
+    return y - prediction
+
+
+def monte_carlo_forecast(model, history, look_back, steps, residuals, paths=FORECAST_PATHS,
+                         quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), seed=None):
+    # residual bootstrap: every path adds resampled one-step errors and feeds them back,
+    # all paths advance together as one (paths, look_back) batch
+    window, single = _windows(history, look_back)
+    if not single:
+        raise ValueError('monte_carlo_forecast takes a single series')
+    rng = np.random.default_rng(seed)
+    noise = rng.choice(np.asarray(residuals, dtype=np.float32).reshape((-1)), size=(paths, int(steps)))
+    forecast = recursive_forecast(model, np.repeat(window, paths, axis=0), look_back, steps, noise)
+    return forecast, np.quantile(forecast, quantiles, axis=0)
+
+
+def direct_forecast(model, history, look_back):
+    window, single = _windows(history, look_back)
+    forecast = np.asarray(model(window[:, :, np.newaxis], training=False))
+    return forecast[0] if single else forecast
+
+
+def train_direct_model(look_back, close_train, steps, epochs):
+    from keras.models import Sequential
+    from keras.layers import LSTM, Dense
+    from windowing import make_windows
+    x, y = make_windows(close_train, look_back, horizon=steps)
+    lstm_model = Sequential()
+    lstm_model.add(
+        LSTM(10,
+        activation='relu',
+        input_shape=(look_back,1))
+    )
+    lstm_model.add(Dense(steps))
+    lstm_model.compile(optimizer='adam', loss='mse')
+    lstm_model.fit(x, y, epochs=epochs, batch_size=20)
+    return lstm_model
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import logging
+import argparse
+
+import numpy as np
+
+'''
+One LSTM for a whole universe of tickers.
+Every series is turned into log returns divided by their standard deviation,
+so windows of different tickers share one scale and the network can be
+trained on all of them at once. Training streams the windows: tickers are read
+from the price store a few at a time (--cycle), cut into windows, and mixed in
+a bounded shuffle buffer, so the universe never has to fit in memory. Only the
+first --train-fraction of each series is used, like split_data.
+The model is stored in the registry under the GLOBAL key, in global_registry()
+where it does not expire with MODEL_MAX_AGE. Forecasting any ticker, one that
+was not in the universe included, then only needs its price history and
+inference:
+
+    python global_model.py universe.txt --epochs 5
+    python batch_forecast.py universe.txt --global-model
+'''
+
+logger = logging.getLogger('stock.global_model')
+
+GLOBAL_KEY = 'GLOBAL'
+GLOBAL_LOOK_BACK = int(os.environ.get('GLOBAL_LOOK_BACK', 30))
+GLOBAL_UNITS = int(os.environ.get('GLOBAL_UNITS', 32))
+
+
+def normalized_returns(close):
+    close = np.asarray(close, dtype=np.float64).reshape((-1))
+    returns = np.diff(np.log(close))
+    sigma = returns.std() or 1.0
+    return returns / sigma, sigma
+
+
+def _ticker_windows(ticker, look_back, train_fraction, period, batch):
+    # one ticker's windows in batches, runs inside tf.data so arguments arrive as numpy values
+    from price_store import default_store
+    from windowing import make_windows
+    ticker = ticker.decode() if isinstance(ticker, bytes) else str(ticker)
+    try:
+        close = default_store().history(ticker, period=period.decode())['Close'].values
+    except Exception as e:
+        logger.warning('skipping %s : %r', ticker, e)
+        return
+    z, _ = normalized_returns(close[:int(len(close) * train_fraction)])
+    if len(z) <= look_back:
+        return
+    x, y = make_windows(z, look_back)
+    for i in range(0, len(y), batch):
+        yield x[i:i + batch].astype(np.float32), y[i:i + batch, np.newaxis].astype(np.float32)
+
+
+def make_global_dataset(tickers, look_back=GLOBAL_LOOK_BACK, batch_size=256, train_fraction=0.8, cycle=8,
+                        shuffle_buffer=50000, period='max', seed=None):
+    import tensorflow as tf
+    signature = (tf.TensorSpec((None, look_back, 1), tf.float32), tf.TensorSpec((None, 1), tf.float32))
+    dataset = tf.data.Dataset.from_tensor_slices(list(tickers)).shuffle(len(tickers), seed=seed)
+    dataset = dataset.interleave(
+        lambda ticker: tf.data.Dataset.from_generator(
+            _ticker_windows, output_signature=signature,
+            args=(ticker, look_back, train_fraction, period, 1024)),
+        cycle_length=cycle, block_length=1)
+    return (dataset.unbatch()
+            .shuffle(shuffle_buffer, seed=seed)
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE))
+
+
+_global_registry = None
+
+def global_registry():
+    # trained once for the whole universe, it is kept until it is retrained
+    global _global_registry
+    if _global_registry is None:
+        from model_registry import ModelRegistry
+        _global_registry = ModelRegistry(max_age=None)
+    return _global_registry
+
+
+def architecture(units=GLOBAL_UNITS):
+    from app import build_model
+    from model_registry import architecture_hash
+    return architecture_hash([build_model, normalized_returns], units)
+
+
+def train_global(tickers, look_back=GLOBAL_LOOK_BACK, units=GLOBAL_UNITS, epochs=5, registry=None, **dataset):
+    import pandas as pd
+    from app import build_model
+    registry = registry or global_registry()
+    model = build_model(look_back, units)
+    model.fit(make_global_dataset(tickers, look_back, **dataset), epochs=epochs, verbose=2)
+    registry.save(GLOBAL_KEY, look_back, architecture(units), pd.Timestamp.today().normalize(), model,
+                  tickers=list(tickers), units=units)
+    return model
+
+
+def load_global(look_back=GLOBAL_LOOK_BACK, units=GLOBAL_UNITS, registry=None):
+    entry = (registry or global_registry()).latest(GLOBAL_KEY, look_back, architecture(units))
+    if entry is None:
+        raise LookupError('no global model for look_back={} units={}, run global_model.py first'.format(
+            look_back, units))
+    return entry[0]
+
+
+def global_forecast(model, close, look_back, steps):
+    # the next `steps` closes after close
+    from forecasting import recursive_forecast
+    close = np.asarray(close, dtype=np.float64).reshape((-1))
+    z, sigma = normalized_returns(close)
+    forecast = recursive_forecast(model, z, look_back, steps)
+    return close[-1] * np.exp(np.cumsum(sigma * np.asarray(forecast, dtype=np.float64)))
+
+
+def one_step_predictions(model, close, look_back, sigma):
+    # prediction of close[look_back + 1:] from the windows before each of them; sigma comes from
+    # the bars before close (e.g. the training split), not from the closes being predicted
+    from windowing import make_windows
+    close = np.asarray(close, dtype=np.float64).reshape((-1))
+    x, _ = make_windows(np.diff(np.log(close)) / sigma, look_back)
+    predicted = np.asarray(model(x.astype(np.float32), training=False))[:, 0]
+    return close[look_back:-1] * np.exp(sigma * predicted)
+
+
+def main(argv=None):
+    from batch_forecast import read_universe
+    parser = argparse.ArgumentParser(description='Train one model on every ticker of a universe.')
+    parser.add_argument('universe', help='text file with one ticker per line')
+    parser.add_argument('--look-back', type=int, default=GLOBAL_LOOK_BACK)
+    parser.add_argument('--units', type=int, default=GLOBAL_UNITS)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--train-fraction', type=float, default=0.8)
+    parser.add_argument('--cycle', type=int, default=8, help='tickers read and mixed at a time')
+    parser.add_argument('--shuffle-buffer', type=int, default=50000)
+    parser.add_argument('--period', default='max')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import keras
+    keras.utils.set_random_seed(args.seed)
+    tickers = read_universe(args.universe)
+    start = time.perf_counter()
+    train_global(tickers, args.look_back, args.units, args.epochs, batch_size=args.batch_size,
+                 train_fraction=args.train_fraction, cycle=args.cycle, shuffle_buffer=args.shuffle_buffer,
+                 period=args.period, seed=args.seed)
+    print('global model for {} tickers trained in {:.1f} s'.format(len(tickers), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
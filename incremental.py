@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from model_registry import default_registry
+
+'''
+Warm-start retraining.
+When a ticker already has a model for (look_back, architecture), the newest one
+is re-registered under the new end-date when the training closes gained no bars,
+and otherwise fine-tuned for a few epochs on the windows that end in bars it has
+not seen, plus a random replay sample of older windows, instead of training from
+scratch.
+A full retrain happens when there is no usable previous model, when too many
+bars were added, after WARM_MAX_UPDATES warm starts in a row, when the new
+prices leave the range the model was trained on by more than WARM_RANGE_DRIFT,
+or when the previous model's error on the new windows exceeds WARM_ERROR_DRIFT
+times its fit error. The fit error is measured in-sample, on the last
+WARM_FIT_WINDOWS windows the model was trained on (holding them out would keep
+the newest bars out of every fit), and bars a model has not seen normally
+score somewhat worse than that, hence the margin of WARM_ERROR_DRIFT.
+'''
+
+WARM_EPOCHS = int(os.environ.get('WARM_EPOCHS', 3))
+WARM_REPLAY = int(os.environ.get('WARM_REPLAY', 256))
+WARM_LEARNING_RATE = float(os.environ.get('WARM_LEARNING_RATE', 1e-4))
+WARM_MAX_NEW_BARS = int(os.environ.get('WARM_MAX_NEW_BARS', 20))
+WARM_MAX_UPDATES = int(os.environ.get('WARM_MAX_UPDATES', 20))
+WARM_RANGE_DRIFT = float(os.environ.get('WARM_RANGE_DRIFT', 0.1))
+WARM_ERROR_DRIFT = float(os.environ.get('WARM_ERROR_DRIFT', 3.0))
+WARM_FIT_WINDOWS = int(os.environ.get('WARM_FIT_WINDOWS', 60))
+
+
+def _mse(model, x, y):
+    prediction = np.asarray(model(x.astype(np.float32), training=False))[:, 0]
+    return float(np.mean((prediction - y) ** 2))
+
+
+def fine_tune(model, x, y, new, seed=None, epochs=WARM_EPOCHS):
+    # a few epochs on the windows in `new` plus a replay sample of the older ones
+    from keras.models import clone_model
+    from keras.optimizers import Adam
+    # the registry may hand the previous model to other callers, fine-tune a copy
+    tuned = clone_model(model)
+    tuned.set_weights(model.get_weights())
+    tuned.compile(optimizer=Adam(learning_rate=WARM_LEARNING_RATE), loss='mse')
+    rng = np.random.default_rng(seed)
+    old = np.arange(new[0])
+    replay = rng.choice(old, size=min(WARM_REPLAY, len(old)), replace=False)
+    index = np.concatenate([replay, new])
+    tuned.fit(x[index], y[index, np.newaxis], epochs=epochs, batch_size=20, shuffle=True, verbose=0)
+    return tuned
+
+
+def _full_train(registry, ticker, look_back, arch, end_date, dates, close, train, scaler):
+    from windowing import make_windows
+    series = scaler.fit_transform(close) if scaler is not None else close
+    model = train(series)
+    x, y = make_windows(series, look_back)
+    registry.save(ticker, look_back, arch, end_date, model, scaler,
+                  train_end=pd.Timestamp(dates.iloc[-1]).isoformat(), warm_starts=0,
+                  fit_mse=_mse(model, x[-WARM_FIT_WINDOWS:], y[-WARM_FIT_WINDOWS:]),
+                  train_min=float(np.min(series)), train_max=float(np.max(series)))
+    return model, scaler, 'full'
+
+
+def warm_start_or_train(ticker, look_back, arch, end_date, dates, close, train, scaler=None,
+                        registry=None, seed=None):
+    # dates / close : raw training closes (n, 1) and their dates
+    # train(series) : full training on the (scaled) closes, returns the model
+    # scaler : unfitted scaler used for a full retrain, None for unscaled models
+    # returns (model, scaler, mode) with mode one of 'hit', 'reuse', 'warm', 'full'
+    from windowing import make_windows
+    registry = registry or default_registry()
+    dates = pd.Series(pd.to_datetime(np.asarray(dates)))
+    close = np.asarray(close).reshape((-1, 1))
+
+    hit = registry.load(ticker, look_back, arch, end_date)
+    if hit is not None:
+        return hit[0], hit[1], 'hit'
+    previous = registry.latest(ticker, look_back, arch)
+    if previous is None or not hasattr(previous[0], 'fit') or 'fit_mse' not in previous[2]:
+        return _full_train(registry, ticker, look_back, arch, end_date, dates, close, train, scaler)
+    model, previous_scaler, meta = previous
+
+    n_new = int((dates > pd.Timestamp(meta['train_end'])).sum())
+    if n_new == 0:
+        # the training part gained no bars (the new ones all went to the test split),
+        # the previous model is the one a retrain would reproduce
+        registry.save(ticker, look_back, arch, end_date, model, previous_scaler,
+                      **{k: v for k, v in meta.items()
+                         if k not in ('ticker', 'look_back', 'arch', 'end_date', 'created_at')})
+        return model, previous_scaler, 'reuse'
+    if n_new > WARM_MAX_NEW_BARS or meta['warm_starts'] >= WARM_MAX_UPDATES:
+        return _full_train(registry, ticker, look_back, arch, end_date, dates, close, train, scaler)
+
+    series = previous_scaler.transform(close) if previous_scaler is not None else close
+    x, y = make_windows(series, look_back)
+    new = np.arange(max(0, len(y) - n_new), len(y))
+    span = meta['train_max'] - meta['train_min']
+    out_of_range = max(meta['train_min'] - y[new].min(), y[new].max() - meta['train_max']) / (span or 1)
+    if out_of_range > WARM_RANGE_DRIFT or _mse(model, x[new], y[new]) > WARM_ERROR_DRIFT * max(meta['fit_mse'], 1e-12):
+        return _full_train(registry, ticker, look_back, arch, end_date, dates, close, train, scaler)
+
+    tuned = fine_tune(model, x, y, new, seed)
+
+    registry.save(ticker, look_back, arch, end_date, tuned, previous_scaler,
+                  train_end=pd.Timestamp(dates.iloc[-1]).isoformat(), warm_starts=meta['warm_starts'] + 1,
+                  fit_mse=_mse(tuned, x[-WARM_FIT_WINDOWS:], y[-WARM_FIT_WINDOWS:]),
+                  train_min=meta['train_min'], train_max=meta['train_max'])
+    return tuned, previous_scaler, 'warm'
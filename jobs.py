@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+'''
+Background jobs for the dashboard.
+A job runs fn(*args, report=...) on a local process pool. Its state lives in
+JOB_DIR/<job_id>.json so any gunicorn worker can answer a poll for it, and the
+result is pickled next to it once the job is done. Submitting a job that is
+already queued or running returns the id of the in-flight one.
+submit_thread runs a short job on a thread of the submitting web worker
+instead, so it does not queue behind training jobs on the process pool.
+'''
+
+logger = logging.getLogger('stock.jobs')
+
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join('cache', 'jobs'))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 60 * 60))
+# each gunicorn worker gets its own pool, together they use one process per core
+JOB_WORKERS = int(os.environ.get(
+    'JOB_WORKERS', max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1)))))
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 2))
+
+_executor = None
+_threads = None
+
+def _pool():
+    global _executor
+    if _executor is None:
+        # spawn, tensorflow does not survive being forked after it has been imported
+        _executor = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _thread_pool():
+    global _threads
+    if _threads is None:
+        _threads = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='jobs')
+    return _threads
+
+
+def _path(job_id, ext):
+    return os.path.join(JOB_DIR, job_id + ext)
+
+
+def job_id_for(*key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def _update(job_id, **fields):
+    state = status(job_id) or {}
+    state.update(fields, updated_at=time.time())
+    tmp = '{}.{}.tmp'.format(_path(job_id, '.json'), os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, _path(job_id, '.json'))
+
+
+def status(job_id):
+    try:
+        with open(_path(job_id, '.json')) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state['status'] in ('queued', 'running') and time.time() - state['updated_at'] > JOB_TIMEOUT:
+        state['status'] = 'failed'
+        state['error'] = 'timed out'
+    return state
+
+
+def result(job_id):
+    with open(_path(job_id, '.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def _release(job_id):
+    if os.path.exists(_path(job_id, '.lock')):
+        os.remove(_path(job_id, '.lock'))
+
+
+def _run(job_id, fn, args):
+    _update(job_id, status='running', started_at=time.time())
+    metrics.observe('job_queue_seconds', time.time() - status(job_id)['submitted_at'])
+    try:
+        with metrics.profiled('job-{}'.format(fn.__name__)), metrics.span('job', job=job_id, args=repr(args)):
+            out = fn(*args, report=lambda **progress: _update(job_id, **progress))
+        tmp = '{}.{}.tmp'.format(_path(job_id, '.pkl'), os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(out, f)
+        os.replace(tmp, _path(job_id, '.pkl'))
+        _update(job_id, status='done')
+        metrics.inc('jobs_total', status='done')
+    except Exception as e:
+        logger.exception('job %s %s%r failed', job_id, fn.__name__, args)
+        _update(job_id, status='failed', error=repr(e))
+        metrics.inc('jobs_total', status='failed')
+    finally:
+        _release(job_id)
+
+
+def _finished(job_id, pool, future):
+    # _run records its own errors, this catches a worker that died under the job (OOM, segfault)
+    global _executor
+    error = 'cancelled' if future.cancelled() else future.exception()
+    if error is None:
+        return
+    if isinstance(error, BrokenProcessPool) and _executor is pool:
+        # a broken pool takes no more work, the next submit starts a fresh one
+        _executor = None
+    logger.error('job %s failed in its worker: %r', job_id, error)
+    state = status(job_id)
+    if state is None or state['status'] in ('queued', 'running'):
+        _update(job_id, status='failed', error=repr(error))
+        metrics.inc('jobs_total', status='failed')
+    _release(job_id)
+
+
+def _claim(fn, args):
+    # returns (job_id, False) while the job is in flight elsewhere, (job_id, True) once it is ours
+    os.makedirs(JOB_DIR, exist_ok=True)
+    job_id = job_id_for(fn.__module__, fn.__name__, *args)
+    lock = _path(job_id, '.lock')
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        if time.time() - os.path.getmtime(lock) < JOB_TIMEOUT:
+            return job_id, False
+        # the process that held it died, take the job over
+        os.utime(lock)
+    for ext in ('.json', '.pkl'):
+        if os.path.exists(_path(job_id, ext)):
+            os.remove(_path(job_id, ext))
+    _update(job_id, status='queued', submitted_at=time.time())
+    return job_id, True
+
+
+def submit(fn, *args):
+    global _executor
+    job_id, claimed = _claim(fn, args)
+    if not claimed:
+        return job_id
+    pool = _pool()
+    try:
+        future = pool.submit(_run, job_id, fn, args)
+    except BrokenProcessPool:
+        _executor = None
+        pool = _pool()
+        future = pool.submit(_run, job_id, fn, args)
+    future.add_done_callback(lambda future: _finished(job_id, pool, future))
+    return job_id
+
+
+def submit_thread(fn, *args):
+    job_id, claimed = _claim(fn, args)
+    if claimed:
+        pool = _thread_pool()
+        pool.submit(_run, job_id, fn, args).add_done_callback(lambda future: _finished(job_id, pool, future))
+    return job_id
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import atexit
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+'''
+Request instrumentation.
+span() times a pipeline stage and logs it as one json line, inc / observe /
+set_gauge record counters, histograms and gauges. Every process (gunicorn
+workers and job processes alike) keeps its own values in memory and a
+background thread mirrors them to METRICS_DIR/<pid>-<start>.json every
+METRICS_FLUSH_SECONDS and at exit, off the request path. render() adds the
+files up in the Prometheus text format, served by register(server) at
+/metrics; the counters and histograms of processes that have exited are folded
+into retired.json and their files deleted, so totals never go backwards and a
+reused pid gets a file of its own. A gauge is the value most recently set by
+any live process.
+With PROFILE_DIR set, profiled() blocks are run under cProfile and dumped there.
+'''
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join('cache', 'metrics'))
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PREFIX = 'stock_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+logger = logging.getLogger('stock.metrics')
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+_flush_lock = threading.Lock()
+_process = {'pid': None, 'path': None, 'dirty': False}
+RETIRED = 'retired.json'
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _process_start(pid):
+    # start time in clock ticks, tells a process from a later one that got the same pid
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return '0'
+
+
+def _alive(name):
+    pid, _, start = name[:-len('.json')].partition('-')
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return start in ('', '0') or _process_start(pid) == start
+
+
+def _touch():
+    # called under _lock by every update
+    if _process['pid'] != os.getpid():
+        # first update of this process; a forked child drops the values it inherited, they are its parent's
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _process.update(pid=os.getpid(), path=os.path.join(
+            METRICS_DIR, '{}-{}.json'.format(os.getpid(), _process_start(os.getpid()))))
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+    _process['dirty'] = True
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def flush():
+    with _flush_lock:
+        with _lock:
+            if not _process['dirty'] or _process['pid'] != os.getpid():
+                return
+            _process['dirty'] = False
+            state = json.dumps({'counters': _counters, 'gauges': _gauges, 'histograms': _histograms})
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp = _process['path'] + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(state)
+        os.replace(tmp, _process['path'])
+
+
+atexit.register(flush)
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _touch()
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _touch()
+        _gauges[_key(name, labels)] = [value, time.time()]
+
+
+def observe(name, value, **labels):
+    with _lock:
+        _touch()
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        histogram = _histograms[key]
+        for n, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][n] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+@contextmanager
+def span(stage, **labels):
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe('stage_seconds', seconds, stage=stage)
+        if status == 'error':
+            inc('stage_errors_total', stage=stage)
+        logger.info(json.dumps(dict(labels, span=stage, seconds=round(seconds, 6), status=status, pid=os.getpid())))
+
+
+@contextmanager
+def profiled(name):
+    if not PROFILE_DIR:
+        yield
+        return
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(PROFILE_DIR, '{}-{}-{}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(), name)))
+
+
+def _labels(items, extra=()):
+    items = list(items) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(total, state):
+    # counters and histograms of one file into the running totals
+    for key, value in state['counters'].items():
+        total['counters'][key] = total['counters'].get(key, 0.0) + value
+    for key, value in state['histograms'].items():
+        histogram = total['histograms'].setdefault(key, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+        histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], value['buckets'])]
+        histogram['sum'] += value['sum']
+        histogram['count'] += value['count']
+
+
+def _retire(names):
+    # folds the files of exited processes into retired.json, one renderer at a time
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [name for name in names if os.path.exists(os.path.join(METRICS_DIR, name)) and not _alive(name)]
+        if not dead:
+            return
+        path = os.path.join(METRICS_DIR, RETIRED)
+        retired = _read(path) or {'counters': {}, 'histograms': {}}
+        for name in dead:
+            state = _read(os.path.join(METRICS_DIR, name))
+            if state is not None:
+                _add(retired, state)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(retired, f)
+        os.replace(tmp, path)
+        for name in dead:
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+def render():
+    flush()
+    total = {'counters': {}, 'histograms': {}}
+    gauges, gauge_times = {}, {}
+    if os.path.isdir(METRICS_DIR):
+        names = sorted(n for n in os.listdir(METRICS_DIR) if n.endswith('.json') and n != RETIRED)
+        _retire(names)
+        retired = _read(os.path.join(METRICS_DIR, RETIRED))
+        if retired is not None:
+            _add(total, retired)
+        for name in names:
+            state = _read(os.path.join(METRICS_DIR, name))
+            if state is None:
+                continue
+            _add(total, state)
+            for key, (value, at) in state['gauges'].items():
+                # the newest value wins, ties go to the file that sorts last
+                if key not in gauges or (at, name) >= gauge_times[key]:
+                    gauges[key], gauge_times[key] = value, (at, name)
+    counters, histograms = total['counters'], total['histograms']
+
+    lines, typed = [], set()
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        for key in sorted(values):
+            name, labels = json.loads(key)
+            header(PREFIX + name, kind)
+            lines.append('{}{}{} {}'.format(PREFIX, name, _labels(labels), values[key]))
+    for key in sorted(histograms):
+        name, labels = json.loads(key)
+        histogram = histograms[key]
+        header(PREFIX + name, 'histogram')
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            lines.append('{}{}_bucket{} {}'.format(PREFIX, name, _labels(labels, [('le', bound)]), count))
+        lines.append('{}{}_bucket{} {}'.format(PREFIX, name, _labels(labels, [('le', '+Inf')]), histogram['count']))
+        lines.append('{}{}_sum{} {}'.format(PREFIX, name, _labels(labels), histogram['sum']))
+        lines.append('{}{}_count{} {}'.format(PREFIX, name, _labels(labels), histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def register(server):
+    from flask import Response
+
+    @server.route('/metrics')
+    def prometheus_metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import copy
+import pickle
+import hashlib
+import inspect
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+from price_store import ticker_key
+
+'''
+Trained-model registry.
+Models are keyed by (ticker, look_back, architecture hash, data end-date) and kept
+under MODEL_DIR/<TICKER>/ as a keras .h5 file, its numpy_lstm export (.npz, MODEL_PRECISION float32, float16 or int8), the
+pickled scaler that was fitted on the training data and a json file with the
+entry's metadata. With MODEL_BACKEND=numpy entries are served from the .npz
+export and tensorflow is never imported.
+An entry older than MODEL_MAX_AGE seconds is treated as a miss and retrained, and
+only the newest MODEL_KEEP end-dates per (ticker, look_back, architecture) are kept.
+'''
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join('cache', 'models'))
+MODEL_MAX_AGE = int(os.environ.get('MODEL_MAX_AGE', 7 * 24 * 60 * 60))
+MODEL_KEEP = int(os.environ.get('MODEL_KEEP', 2))
+MODEL_MEMORY_SLOTS = int(os.environ.get('MODEL_MEMORY_SLOTS', 16))
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'float32')
+# 0 : only MODEL_MEMORY_SLOTS bounds the loaded models
+MODEL_MEMORY_MB = float(os.environ.get('MODEL_MEMORY_MB', 0))
+
+
+def resident_bytes(model):
+    # weights of a loaded model as kept in memory, quantized for NumpyModel
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    return 4 * model.count_params()
+
+
+def architecture_hash(train_fn, *args):
+    # the training function's source plus its arguments identifies the network
+    # and the way it was fitted; editing train_model invalidates old entries
+    # train_fn may be a list of functions, e.g. the model builder and the training loop
+    source = ''
+    for fn in (train_fn if isinstance(train_fn, (list, tuple)) else [train_fn]):
+        try:
+            source += inspect.getsource(fn)
+        except (OSError, TypeError):
+            source += fn.__qualname__ + fn.__code__.co_code.hex()
+    return hashlib.sha1((source + repr(args)).encode()).hexdigest()[:12]
+
+
+class ModelRegistry:
+    def __init__(self, directory=MODEL_DIR, max_age=MODEL_MAX_AGE, keep=MODEL_KEEP,
+                 memory_slots=MODEL_MEMORY_SLOTS, backend=MODEL_BACKEND, precision=MODEL_PRECISION,
+                 memory_mb=MODEL_MEMORY_MB):
+        self.directory = directory
+        self.backend = backend
+        self.precision = precision
+        self.memory_bytes = memory_mb * 2 ** 20
+        self.max_age = max_age
+        self.keep = keep
+        self.memory_slots = memory_slots
+        self._memory = OrderedDict()
+
+    def _base(self, ticker, look_back, arch, end_date):
+        name = '{}_{}_{}'.format(look_back, arch, pd.Timestamp(end_date).strftime('%Y%m%d'))
+        return os.path.join(self.directory, ticker_key(ticker), name)
+
+    def _remember(self, base, entry):
+        self._memory[base] = entry
+        self._memory.move_to_end(base)
+        while len(self._memory) > self.memory_slots or (self.memory_bytes and len(self._memory) > 1 and sum(
+                resident_bytes(model) for model, _, _ in self._memory.values()) > self.memory_bytes):
+            self._memory.popitem(last=False)
+
+    def _expired(self, meta):
+        return self.max_age is not None and time.time() - meta['created_at'] > self.max_age
+
+    def _remove(self, base):
+        self._memory.pop(base, None)
+        for ext in ('.json', '.h5', '.npz', '.scaler.pkl'):
+            if os.path.exists(base + ext):
+                os.remove(base + ext)
+
+    def _read(self, base):
+        with open(base + '.json') as f:
+            meta = json.load(f)
+        if self._expired(meta):
+            self._remove(base)
+            return None
+        if self.backend == 'numpy':
+            if not os.path.exists(base + '.npz'):
+                return None
+            from numpy_lstm import NumpyModel
+            model = NumpyModel.load(base + '.npz')
+        else:
+            from keras.models import load_model
+            model = load_model(base + '.h5', compile=False)
+        scaler = None
+        if os.path.exists(base + '.scaler.pkl'):
+            with open(base + '.scaler.pkl', 'rb') as f:
+                scaler = pickle.load(f)
+        return model, scaler, meta
+
+    def load(self, ticker, look_back, arch, end_date):
+        base = self._base(ticker, look_back, arch, end_date)
+        entry = self._memory.get(base)
+        if entry is not None and self._expired(entry[2]):
+            self._remove(base)
+            entry = None
+        if entry is None and os.path.exists(base + '.json'):
+            entry = self._read(base)
+        if entry is None:
+            return None
+        self._remember(base, entry)
+        return entry[0], entry[1]
+
+    def latest(self, ticker, look_back, arch):
+        # newest stored entry regardless of end-date, as (model, scaler, meta)
+        folder = os.path.join(self.directory, ticker_key(ticker))
+        prefix = '{}_{}_'.format(look_back, arch)
+        if not os.path.isdir(folder):
+            return None
+        names = sorted(n[:-len('.json')] for n in os.listdir(folder)
+                       if n.startswith(prefix) and n.endswith('.json'))
+        for name in reversed(names):
+            base = os.path.join(folder, name)
+            entry = self._memory.get(base) or self._read(base)
+            if entry is not None:
+                return entry
+        return None
+
+    def save(self, ticker, look_back, arch, end_date, model, scaler=None, **extra):
+        base = self._base(ticker, look_back, arch, end_date)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        meta = dict(extra, ticker=ticker.upper(), look_back=look_back, arch=arch,
+                    end_date=pd.Timestamp(end_date).isoformat(), created_at=time.time())
+        tmp = '{}.{}.tmp.h5'.format(base, os.getpid())
+        model.save(tmp)
+        os.replace(tmp, base + '.h5')
+        from numpy_lstm import export_model
+        try:
+            export_model(model, base + '.npz', self.precision)
+        except ValueError:
+            # not a plain LSTM + Dense stack, only the keras backend can serve it
+            pass
+        if scaler is not None:
+            # app2 refits one module-level scaler per request, keep our own copy
+            scaler = copy.deepcopy(scaler)
+            with open(base + '.scaler.pkl', 'wb') as f:
+                pickle.dump(scaler, f)
+        # the json is written last, an entry only counts once it exists
+        with open(base + '.json', 'w') as f:
+            json.dump(meta, f)
+        self._remember(base, (model, scaler, meta))
+        self._prune(ticker, look_back, arch)
+
+    def _prune(self, ticker, look_back, arch):
+        folder = os.path.join(self.directory, ticker_key(ticker))
+        prefix = '{}_{}_'.format(look_back, arch)
+        names = sorted(n[:-len('.json')] for n in os.listdir(folder)
+                       if n.startswith(prefix) and n.endswith('.json'))
+        for name in names[:-self.keep]:
+            self._remove(os.path.join(folder, name))
+
+    def get_or_train(self, ticker, look_back, arch, end_date, train, scaler=None):
+        hit = self.load(ticker, look_back, arch, end_date)
+        metrics.inc('model_registry_requests_total', result='miss' if hit is None else 'hit')
+        if hit is not None:
+            return hit
+        model = train()
+        self.save(ticker, look_back, arch, end_date, model, scaler)
+        return model, scaler
+
+
+_default_registry = None
+
+def default_registry():
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    return _default_registry
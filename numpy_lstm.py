@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+'''
+TensorFlow-free inference for the networks built by train_model.
+export_model writes the weights of a Sequential LSTM + Dense stack to a .npz
+file, NumpyModel loads it and reproduces the forward pass with NumPy only.
+With precision='float16' the kernels are stored as half floats, with 'int8'
+as bytes plus one float32 scale per output unit (symmetric, per channel); the
+biases stay float32. NumpyModel keeps them in that form, a quarter or half of
+the float32 memory, and widens a layer's kernels to float32 only for the
+duration of a call; widened() makes a float32 copy for a whole rollout.
+MODEL_PRECISION picks the precision of the registry's exports.
+
+    python numpy_lstm.py model.h5 model.npz --precision int8
+'''
+
+PRECISIONS = ('float32', 'float16', 'int8')
+KERNELS = ('kernel', 'recurrent_kernel')
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+}
+
+
+def quantize(value, precision):
+    # the arrays stored for one kernel
+    if precision == 'float16':
+        return {'': value.astype(np.float16)}
+    if precision == 'int8':
+        scale = np.abs(value).max(axis=0) / 127
+        scale[scale == 0] = 1
+        return {'': np.round(value / scale).astype(np.int8), '_scale': scale.astype(np.float32)}
+    return {'': value.astype(np.float32)}
+
+
+def export_model(model, path, precision='float32'):
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision '{}', expected one of {}".format(precision, PRECISIONS))
+    layers, arrays = [], {}
+    for n, layer in enumerate(model.layers):
+        kind = type(layer).__name__
+        config = layer.get_config()
+        if kind == 'LSTM':
+            if config.get('return_sequences') or config.get('go_backwards'):
+                raise ValueError("Unsupported LSTM configuration in layer '{}'".format(layer.name))
+            spec = {'kind': kind, 'activation': config['activation'],
+                    'recurrent_activation': config['recurrent_activation']}
+            names = ('kernel', 'recurrent_kernel', 'bias')
+        elif kind == 'Dense':
+            spec = {'kind': kind, 'activation': config['activation']}
+            names = ('kernel', 'bias')
+        else:
+            raise ValueError("Unsupported layer type '{}'".format(kind))
+        for activation in (spec['activation'], spec.get('recurrent_activation', 'linear')):
+            if activation not in ACTIVATIONS:
+                raise ValueError("Unsupported activation '{}'".format(activation))
+        weights = layer.get_weights()
+        if len(weights) != len(names):
+            raise ValueError("Layer '{}' has no bias".format(layer.name))
+        for name, value in zip(names, weights):
+            stored = quantize(value, precision) if name in KERNELS else {'': value.astype(np.float32)}
+            for suffix, array in stored.items():
+                arrays['{}_{}{}'.format(n, name, suffix)] = array
+        layers.append(spec)
+    with open(path, 'wb') as f:
+        np.savez(f, layers=np.array(json.dumps(layers)), precision=np.array(precision), **arrays)
+
+
+class NumpyModel:
+    def __init__(self, layers, arrays, precision='float32'):
+        self.layers = layers
+        self.arrays = arrays
+        self.precision = precision
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            layers = json.loads(str(data['layers']))
+            # exports from before quantization have no precision entry
+            precision = str(data['precision']) if 'precision' in data.files else 'float32'
+            arrays = {key: data[key] for key in data.files if key not in ('layers', 'precision')}
+        return cls(layers, arrays, precision)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def count_params(self):
+        # like keras, the int8 scales are not parameters
+        return int(sum(array.size for key, array in self.arrays.items() if not key.endswith('_scale')))
+
+    def widened(self):
+        # a float32 copy, for loops that call the model many times in a row
+        if self.precision == 'float32':
+            return self
+        arrays = {key: value for key, value in self.arrays.items() if not key.endswith('_scale')}
+        for key in arrays:
+            n, name = key.split('_', 1)
+            arrays[key] = self._weight(n, name)
+        return NumpyModel(self.layers, arrays)
+
+    def _weight(self, n, name):
+        value = self.arrays['{}_{}'.format(n, name)]
+        if value.dtype == np.int8:
+            return value.astype(np.float32) * self.arrays['{}_{}_scale'.format(n, name)]
+        return value.astype(np.float32, copy=False)
+
+    def _lstm(self, n, spec, x):
+        kernel = self._weight(n, 'kernel')
+        recurrent = self._weight(n, 'recurrent_kernel')
+        bias = self.arrays['{}_bias'.format(n)]
+        act = ACTIVATIONS[spec['activation']]
+        recurrent_act = ACTIVATIONS[spec['recurrent_activation']]
+        units = recurrent.shape[0]
+        # input projections for every time step at once, only the recurrence is sequential
+        z_all = x @ kernel + bias
+        h = np.zeros((x.shape[0], units), dtype=np.float32)
+        c = np.zeros((x.shape[0], units), dtype=np.float32)
+        for t in range(x.shape[1]):
+            z = z_all[:, t] + h @ recurrent
+            i = recurrent_act(z[:, :units])
+            f = recurrent_act(z[:, units:2 * units])
+            g = act(z[:, 2 * units:3 * units])
+            o = recurrent_act(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * act(c)
+        return h
+
+    def __call__(self, x, training=False):
+        x = np.asarray(x, dtype=np.float32)
+        for n, spec in enumerate(self.layers):
+            if spec['kind'] == 'LSTM':
+                x = self._lstm(n, spec, x)
+            else:
+                x = ACTIVATIONS[spec['activation']](x @ self._weight(n, 'kernel') + self.arrays['{}_bias'.format(n)])
+        return x
+
+    def predict(self, x, verbose=0):
+        # accepts an array, a keras Sequence or a tf.data.Dataset of (x, y) batches
+        if hasattr(x, '__getitem__') and not isinstance(x, np.ndarray):
+            x = np.concatenate([x[i][0] for i in range(len(x))])
+        elif not isinstance(x, np.ndarray):
+            x = np.concatenate([np.asarray(batch[0]) for batch in x])
+        return self(x)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a keras LSTM + Dense model for NumpyModel.')
+    parser.add_argument('model', help='.h5 or .keras file')
+    parser.add_argument('output', help='.npz file')
+    parser.add_argument('--precision', choices=PRECISIONS, default='int8')
+    args = parser.parse_args(argv)
+
+    from keras.models import load_model
+    model = load_model(args.model, compile=False)
+    export_model(model, args.output, args.precision)
+    print('{} : {} parameters, {:.1f} KB -> {} {:.1f} KB'.format(
+        args.model, model.count_params(), os.path.getsize(args.model) / 1024, args.output,
+        os.path.getsize(args.output) / 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+'''
+Data-parallel training of the dashboard model on one many-core machine.
+The CPU is split into --replicas logical devices and the model is trained under
+a tf.distribute.MirroredStrategy: every step's global batch is sharded across
+the replicas, each computes the gradients of its shard and the averaged
+gradients update one set of weights. Training stops like the notebook's
+EarlyStopping(patience=10, monitor='loss', restore_best_weights=True), on
+val_loss when --validation is given.
+Replicas, batch size and intra / inter-op threads are picked by
+--tune-throughput, which times a few steps of every combination in a fresh
+process (threads and logical devices are fixed once tensorflow starts) and
+saves the fastest to TUNING_DIR/parallel.json for later runs.
+The model lands in the registry with the dashboard's look_back and units but
+under an architecture key of its own, parallel_version(), which hashes
+train_parallel with its batch size, epochs, patience and validation split: it
+is fitted differently from the dashboard's train_model, so the dashboard never
+serves it as one of those; batch_forecast.py --parallel-model forecasts with it:
+
+    python parallel_training.py --tune-throughput
+    python parallel_training.py AAPL MSFT --epochs 100
+    python batch_forecast.py universe.txt --parallel-model --epochs 100
+'''
+
+DEFAULT_SETUP = {'replicas': 1, 'batch_size': 256, 'intra_threads': 0, 'inter_threads': 0}
+
+
+def _setup_path():
+    from tuning import TUNING_DIR
+    return os.path.join(TUNING_DIR, 'parallel.json')
+
+
+def tuned_setup():
+    try:
+        with open(_setup_path()) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return dict(DEFAULT_SETUP)
+    return {k: saved.get(k, v) for k, v in DEFAULT_SETUP.items()}
+
+
+def configure(replicas, intra_threads=0, inter_threads=0):
+    # has to run before tensorflow creates its devices; 0 threads: every core / one per replica
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_threads or len(os.sched_getaffinity(0)))
+    tf.config.threading.set_inter_op_parallelism_threads(inter_threads or max(2, replicas))
+    if replicas <= 1:
+        return tf.distribute.get_strategy()
+    cpu = tf.config.list_physical_devices('CPU')[0]
+    tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * replicas)
+    return tf.distribute.MirroredStrategy(['/cpu:{}'.format(i) for i in range(replicas)],
+                                          cross_device_ops=tf.distribute.ReductionToOneDevice())
+
+
+def train_parallel(strategy, look_back, data, epochs, batch_size=256, units=10, patience=10, validation=0.0,
+                   callbacks=None, seed=None, verbose=2):
+    import keras
+    from app import build_model
+    from windowing import make_dataset
+    split = int(len(data) * (1 - validation))
+    train = make_dataset(data[:split], look_back, batch_size, shuffle=True, seed=seed)
+    val = make_dataset(data[split - look_back:], look_back, batch_size) if validation else None
+    stop = keras.callbacks.EarlyStopping(monitor='val_loss' if validation else 'loss', mode='min',
+                                         patience=patience, restore_best_weights=True)
+    with strategy.scope():
+        model = build_model(look_back, units)
+    history = model.fit(train, epochs=epochs, validation_data=val, callbacks=[stop] + list(callbacks or []),
+                        verbose=verbose)
+    return model, history.history
+
+
+def probe(replicas, batch_size, intra_threads=0, inter_threads=0, look_back=15, units=10, bars=20000,
+          steps=50):
+    # windows per second of a short fit, in the calling process
+    import keras
+    strategy = configure(replicas, intra_threads, inter_threads)
+    from app import build_model
+    from windowing import make_dataset
+    keras.utils.set_random_seed(0)
+    series = np.cumsum(np.random.default_rng(0).normal(0, 1, bars)).reshape((-1, 1))
+    dataset = make_dataset(series, look_back, batch_size, shuffle=True, seed=0).repeat()
+    with strategy.scope():
+        model = build_model(look_back, units)
+    model.fit(dataset, epochs=1, steps_per_epoch=5, verbose=0)
+    start = time.perf_counter()
+    model.fit(dataset, epochs=1, steps_per_epoch=steps, verbose=0)
+    return steps * batch_size / (time.perf_counter() - start)
+
+
+def probe_process(setup, cores=None, **kwargs):
+    # probe() in a fresh process, optionally restricted to the first `cores` cores
+    code = 'import json, sys; from parallel_training import probe; print(json.dumps(probe(**json.loads(sys.argv[1]))))'
+    preexec = None
+    if cores:
+        preexec = lambda: os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cores])
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    out = subprocess.run([sys.executable, '-c', code, json.dumps(dict(setup, **kwargs))], capture_output=True,
+                         text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                         preexec_fn=preexec)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def tune_throughput(replicas=None, batch_sizes=(64, 256, 1024), inter_threads=(0,), cores=None, **kwargs):
+    cores = cores or len(os.sched_getaffinity(0))
+    replicas = replicas or sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+    results = []
+    for n in replicas:
+        for batch_size in batch_sizes:
+            for inter in inter_threads:
+                setup = dict(DEFAULT_SETUP, replicas=n, batch_size=batch_size, inter_threads=inter)
+                setup['windows_per_s'] = probe_process(setup, cores, **kwargs)
+                print(setup)
+                results.append(setup)
+    return max(results, key=lambda s: s['windows_per_s']), results
+
+
+def save_setup(setup):
+    path = _setup_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(dict(setup, cores=len(os.sched_getaffinity(0)), created_at=time.time()), f)
+    os.replace(tmp, path)
+
+
+def parallel_version(stock, batch_size, epochs, patience, validation):
+    # the dashboard's look_back / units, and a key that says how the model was fitted
+    import app
+    from model_registry import architecture_hash
+    look_back, units, _, _ = app.model_version(stock)
+    arch = architecture_hash([app.build_model, train_parallel], units, batch_size, epochs, patience, validation)
+    return look_back, units, arch
+
+
+def load_parallel(stock, batch_size, epochs, patience, validation):
+    # newest model train_ticker saved for the ticker with this fitting, as (model, look_back)
+    from model_registry import default_registry
+    look_back, _, arch = parallel_version(stock, batch_size, epochs, patience, validation)
+    entry = default_registry().latest(stock, look_back, arch)
+    if entry is None:
+        raise LookupError('no parallel-trained model for {} with batch_size={} epochs={} patience={} '
+                          'validation={}, run parallel_training.py first'.format(
+                              stock, batch_size, epochs, patience, validation))
+    return entry[0], look_back
+
+
+def train_ticker(strategy, stock, setup, epochs, patience, validation, seed):
+    import app
+    from model_registry import default_registry
+    df, close_data, _ = app.download_and_process_data(stock)
+    close_train, _, _, _ = app.split_data(close_data, df)
+    look_back, units, arch = parallel_version(stock, setup['batch_size'], epochs, patience, validation)
+    model, history = train_parallel(strategy, look_back, close_train, epochs, setup['batch_size'], units,
+                                    patience, validation, seed=seed)
+    default_registry().save(stock, look_back, arch, df['Date'].iloc[-1], model, replicas=setup['replicas'],
+                            epochs_run=len(history['loss']))
+    return history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Data-parallel training of the dashboard model.')
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--tune-throughput', action='store_true',
+                        help='time replicas x batch sizes and save the fastest setup')
+    parser.add_argument('--replicas', type=int, help='default: the tuned setup')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--intra-threads', type=int)
+    parser.add_argument('--inter-threads', type=int)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--patience', type=int, default=10)
+    parser.add_argument('--validation', type=float, default=0.0,
+                        help='stop on the loss of this last fraction of the training split')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.tune_throughput:
+        best, _ = tune_throughput(replicas=[args.replicas] if args.replicas else None,
+                                  batch_sizes=[args.batch_size] if args.batch_size else (64, 256, 1024))
+        save_setup(best)
+        print('fastest : {}'.format(best))
+        return 0
+
+    import keras
+    setup = tuned_setup()
+    for name in ('replicas', 'batch_size', 'intra_threads', 'inter_threads'):
+        if getattr(args, name) is not None:
+            setup[name] = getattr(args, name)
+    strategy = configure(setup['replicas'], setup['intra_threads'], setup['inter_threads'])
+    keras.utils.set_random_seed(args.seed)
+    for ticker in args.tickers:
+        start = time.perf_counter()
+        history = train_ticker(strategy, ticker, setup, args.epochs, args.patience, args.validation, args.seed)
+        monitor = 'val_loss' if args.validation else 'loss'
+        print('{} : best {} {:.6g} after {} epochs, {:.1f} s with {}'.format(
+            ticker, monitor, min(history[monitor]), len(history['loss']),
+            time.perf_counter() - start, setup))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
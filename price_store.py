@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+
+import pandas as pd
+
+import metrics
+
+'''
+Local OHLCV store.
+Each ticker's history is kept as a parquet file under STORE_DIR, next to a small
+json file recording which period it covers and when it was last topped up.
+Only the bars after the last stored date are requested from the data source.
+'''
+
+STORE_DIR = os.environ.get('PRICE_STORE_DIR', os.path.join('cache', 'prices'))
+REFRESH_SECONDS = int(os.environ.get('PRICE_REFRESH_SECONDS', 15 * 60))
+
+
+class DataSource:
+    def fetch(self, ticker, start=None):
+        raise NotImplementedError
+
+
+class YahooSource(DataSource):
+    def fetch(self, ticker, start=None):
+        import yfinance
+        if start is None:
+            return yfinance.download(ticker, period='max')
+        return yfinance.download(ticker, start=start.strftime('%Y-%m-%d'))
+
+
+class CSVSource(DataSource):
+    # offline / fixture provider, reads <directory>/<ticker>.csv (e.g. AAPL.csv)
+    def __init__(self, directory='.'):
+        self.directory = directory
+
+    def fetch(self, ticker, start=None):
+        path = os.path.join(self.directory, '{}.csv'.format(ticker))
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        df = pd.read_csv(path, index_col='Date', parse_dates=True)
+        df.sort_index(inplace=True)
+        if start is not None:
+            df = df[df.index >= start]
+        return df
+
+
+def period_start(period):
+    if period is None or period == 'max':
+        return None
+    match = re.fullmatch(r'(\d+)(d|mo|y)', period)
+    if match is None:
+        raise ValueError("Unsupported period '{}'".format(period))
+    n, unit = int(match.group(1)), match.group(2)
+    offset = {'d': pd.DateOffset(days=n), 'mo': pd.DateOffset(months=n), 'y': pd.DateOffset(years=n)}[unit]
+    return pd.Timestamp.today().normalize() - offset
+
+
+def ticker_key(ticker):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', ticker.upper())
+
+
+def source_from_env():
+    spec = os.environ.get('PRICE_SOURCE', 'yahoo')
+    if spec.startswith('csv:'):
+        return CSVSource(spec[len('csv:'):])
+    return YahooSource()
+
+
+class PriceStore:
+    def __init__(self, source=None, directory=STORE_DIR, refresh_seconds=REFRESH_SECONDS):
+        self.source = source if source is not None else source_from_env()
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+
+    def _paths(self, ticker):
+        base = os.path.join(self.directory, ticker_key(ticker))
+        return base + '.parquet', base + '.json'
+
+    def _read(self, ticker):
+        data_path, meta_path = self._paths(ticker)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None, None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return pd.read_parquet(data_path), meta
+
+    def _write(self, ticker, df, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, meta_path = self._paths(ticker)
+        # write-then-rename so concurrent gunicorn workers never read a partial file
+        tmp = '{}.{}.tmp'.format(data_path, os.getpid())
+        df.to_parquet(tmp)
+        os.replace(tmp, data_path)
+        tmp = '{}.{}.tmp'.format(meta_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def last_date(self, ticker):
+        # date of the last stored bar from the json alone, no download and no parquet read; None when unknown
+        try:
+            with open(self._paths(ticker)[1]) as f:
+                end = json.load(f).get('end')
+        except (OSError, ValueError):
+            return None
+        return None if end is None else pd.Timestamp(end)
+
+    def history(self, ticker, period='max'):
+        start = period_start(period)
+        cached, meta = self._read(ticker)
+        covered = cached is not None and len(cached) > 0 and (
+            meta['start'] is None or (start is not None and pd.Timestamp(meta['start']) <= start))
+
+        if not covered:
+            metrics.inc('price_store_requests_total', result='miss')
+            df = self.source.fetch(ticker, start)
+            meta = {'start': None if start is None else start.isoformat()}
+        elif time.time() - meta['fetched_at'] < self.refresh_seconds:
+            metrics.inc('price_store_requests_total', result='hit')
+            df = cached
+        else:
+            metrics.inc('price_store_requests_total', result='topup')
+            # refetch from the last stored bar so a partial session bar gets replaced
+            new = self.source.fetch(ticker, cached.index[-1])
+            df = pd.concat([cached, new])
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+
+        if df is None or len(df) == 0:
+            return pd.DataFrame()
+        if df is not cached:
+            meta['fetched_at'] = time.time()
+            meta['end'] = pd.Timestamp(df.index[-1]).isoformat()
+            self._write(ticker, df, meta)
+        if start is not None:
+            df = df[df.index >= start]
+        return df.copy()
+
+
+_default_store = None
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = PriceStore()
+    return _default_store
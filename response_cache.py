@@ -0,0 +1,102 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+import metrics
+
+'''
+Dashboard response cache.
+The outputs of a finished pipeline run (both figure specs, the R2 text and the
+business summary) are pickled into one SQLite file at RESPONSE_CACHE_PATH,
+keyed by (ticker, data end-date, model version), so every gunicorn worker
+serves a ticker somebody else already asked for without downloading, training
+or plotting it again. Entries expire after RESPONSE_CACHE_TTL seconds, a new
+bar or a new model version changes the key anyway; beyond
+RESPONSE_CACHE_MAX_ENTRIES the oldest entries are dropped. The dashboard builds
+the key from the price store's last stored bar without topping it up, so an
+entry keeps being served until it expires, even after a newer bar came out.
+Identical requests that miss are coalesced: across workers by jobs.submit,
+which hands every caller the id of the one in-flight job, and inside a worker
+by get_or_compute, which lets one thread compute a key while the others wait
+for its result.
+'''
+
+RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', os.path.join('cache', 'responses.sqlite'))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60 * 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+
+
+def response_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _db(self):
+        # one connection per thread and process, sqlite connections must not cross a fork
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS responses '
+                       '(key TEXT PRIMARY KEY, value BLOB, created_at REAL, expires_at REAL)')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def get(self, key):
+        row = self._db().execute('SELECT value FROM responses WHERE key = ? AND expires_at > ?',
+                                 (key, time.time())).fetchone()
+        metrics.inc('response_cache_requests_total', result='miss' if row is None else 'hit')
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, key, value, ttl=None):
+        now = time.time()
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                   (key, pickle.dumps(value), now, now + (self.ttl if ttl is None else ttl)))
+        db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        db.execute('DELETE FROM responses WHERE key IN '
+                   '(SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def get_or_compute(self, key, compute, ttl=None):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {'done': threading.Event(), 'value': None}
+        if not leader:
+            metrics.inc('response_cache_coalesced_total')
+            flight['done'].wait()
+            return flight['value']
+        try:
+            flight['value'] = compute()
+            if flight['value'] is not None:
+                self.put(key, flight['value'], ttl)
+            return flight['value']
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight['done'].set()
+
+
+_default_cache = None
+
+def default_response_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
@@ -0,0 +1,337 @@
+import os
+import sys
+import time
+import atexit
+import sqlite3
+import logging
+import argparse
+import threading
+
+'''
+Forecast precomputation.
+Every dashboard submit is recorded in a request log (REQUEST_LOG_PATH). On a
+timetable tied to each exchange's sessions, SCHEDULER_TIMES (default 30
+minutes before the open and 15 after the close), the scheduler runs
+app.run_pipeline for the SCHEDULER_WATCHLIST tickers and the SCHEDULER_TOP most
+requested ones of that exchange, most requested first. This tops up the price
+store, trains or loads the model and leaves the rendered outputs in the
+response cache until the next run, so the callback only looks them up.
+Work runs on SCHEDULER_WORKERS niced processes and stops being handed out once
+the pipelines of a run have used SCHEDULER_CPU_SECONDS of CPU time.
+Sessions are weekdays, or the exchange_calendars sessions (holidays included)
+when that package is installed.
+
+    python scheduler.py                  # forever, next to the web server
+    python scheduler.py --once AAPL      # one run now
+    SCHEDULER_IN_PROCESS=1 gunicorn ...  # one web worker at a time runs it on a thread
+'''
+
+logger = logging.getLogger('stock.scheduler')
+
+REQUEST_LOG_PATH = os.environ.get('REQUEST_LOG_PATH', os.path.join('cache', 'requests.sqlite'))
+# days of requests that count towards a ticker's rank
+REQUEST_WINDOW_DAYS = float(os.environ.get('REQUEST_WINDOW_DAYS', 7))
+SCHEDULER_WATCHLIST = os.environ.get('SCHEDULER_WATCHLIST')
+SCHEDULER_TOP = int(os.environ.get('SCHEDULER_TOP', 50))
+SCHEDULER_TIMES = os.environ.get('SCHEDULER_TIMES', 'open-30,close+15')
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+SCHEDULER_CPU_SECONDS = float(os.environ.get('SCHEDULER_CPU_SECONDS', 3600))
+SCHEDULER_IN_PROCESS = os.environ.get('SCHEDULER_IN_PROCESS', '0') == '1'
+
+# yahoo suffix : (exchange_calendars name, timezone, open, close)
+EXCHANGES = {'': ('XNYS', 'America/New_York', '09:30', '16:00'),
+             'NS': ('XBOM', 'Asia/Kolkata', '09:15', '15:30'),
+             'BO': ('XBOM', 'Asia/Kolkata', '09:15', '15:30'),
+             'L': ('XLON', 'Europe/London', '08:00', '16:30'),
+             'DE': ('XETR', 'Europe/Berlin', '09:00', '17:30'),
+             'PA': ('XPAR', 'Europe/Paris', '09:00', '17:30'),
+             'TO': ('XTSE', 'America/Toronto', '09:30', '16:00'),
+             'T': ('XTKS', 'Asia/Tokyo', '09:00', '15:00'),
+             'HK': ('XHKG', 'Asia/Hong_Kong', '09:30', '16:00'),
+             'AX': ('XASX', 'Australia/Sydney', '10:00', '16:00')}
+
+
+class RequestLog:
+    def __init__(self, path=REQUEST_LOG_PATH, window_days=REQUEST_WINDOW_DAYS, flush_seconds=5):
+        self.path = path
+        self.window = window_days * 24 * 60 * 60
+        self.flush_seconds = flush_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flusher = None
+        self._pruned_at = 0.0
+        atexit.register(self.flush)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS requests (ticker TEXT, at REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS requests_at ON requests (at)')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def record(self, ticker):
+        # called by the dashboard callback: only buffered, a background thread writes the batches
+        from price_store import ticker_key
+        with self._lock:
+            self._pending.append((ticker_key(ticker), time.time()))
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name='request-log', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning('writing the request log failed : %r', e)
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        now = time.time()
+        db = self._db()
+        db.execute('BEGIN')
+        db.executemany('INSERT INTO requests VALUES (?, ?)', rows)
+        if now - self._pruned_at > 60 * 60:
+            # requests that left the ranking window, at most once an hour
+            db.execute('DELETE FROM requests WHERE at < ?', (now - self.window,))
+            self._pruned_at = now
+        db.execute('COMMIT')
+
+    def counts(self):
+        self.flush()
+        rows = self._db().execute('SELECT ticker, COUNT(*) FROM requests WHERE at >= ? GROUP BY ticker',
+                                  (time.time() - self.window,))
+        return dict(rows.fetchall())
+
+
+_default_log = None
+
+def default_request_log():
+    global _default_log
+    if _default_log is None:
+        _default_log = RequestLog()
+    return _default_log
+
+
+def exchange_of(ticker):
+    suffix = ticker.upper().rsplit('.', 1)[1] if '.' in ticker else ''
+    return EXCHANGES.get(suffix, EXCHANGES[''])
+
+
+def is_session(calendar, day):
+    try:
+        import exchange_calendars
+    except ImportError:
+        return day.weekday() < 5
+    try:
+        return exchange_calendars.get_calendar(calendar).is_session(day.strftime('%Y-%m-%d'))
+    except Exception:
+        # outside the calendar's range or an unknown exchange
+        return day.weekday() < 5
+
+
+def parse_times(spec):
+    # "open-30,close+15" -> [('open', -30), ('close', 15)], offsets in minutes
+    times = []
+    for item in spec.split(','):
+        item = item.strip()
+        event = item[:4] if item.startswith('open') else item[:5]
+        if event not in ('open', 'close'):
+            raise ValueError("Unsupported scheduler time '{}'".format(item))
+        times.append((event, int(item[len(event):] or 0)))
+    return times
+
+
+def upcoming_runs(exchange, times, now, days=10):
+    # UTC timestamps of the runs of one exchange after now
+    import pandas as pd
+    calendar, timezone, opens, closes = exchange
+    local = pd.Timestamp(now, unit='s', tz='UTC').tz_convert(timezone).normalize()
+    runs = []
+    for day in pd.date_range(local, periods=days, freq='D'):
+        if not is_session(calendar, day):
+            continue
+        for event, offset in times:
+            at = pd.Timestamp('{} {}'.format(day.strftime('%Y-%m-%d'), opens if event == 'open' else closes),
+                              tz=timezone) + pd.Timedelta(minutes=offset)
+            if at.timestamp() > now:
+                runs.append(at.timestamp())
+    return sorted(runs)
+
+
+def read_watchlist(path=SCHEDULER_WATCHLIST):
+    if not path:
+        return []
+    from batch_forecast import read_universe
+    return read_universe(path)
+
+
+def plan(watchlist=None, top=SCHEDULER_TOP, log=None):
+    # tickers to precompute, most requested first; the watchlist is always included
+    from price_store import ticker_key
+    counts = (log or default_request_log()).counts()
+    popular = sorted(counts, key=counts.get, reverse=True)[:top]
+    tickers = list(dict.fromkeys([ticker_key(t) for t in (watchlist or [])] + popular))
+    return sorted(tickers, key=lambda t: -counts.get(t, 0))
+
+
+def _init_worker(threads):
+    from batch_forecast import pin_threads
+    # precomputation must not slow down the web workers' own jobs
+    os.nice(10)
+    pin_threads(threads)
+
+
+def precompute(ticker, ttl):
+    import app
+    from price_store import default_store
+    from response_cache import default_response_cache
+    start = time.process_time()
+    outputs = app.run_pipeline(ticker)
+    # kept until the next run instead of RESPONSE_CACHE_TTL
+    end_date = default_store().history(ticker, period='max').index[-1]
+    default_response_cache().put(app.pipeline_key(ticker, end_date), outputs, ttl)
+    return time.process_time() - start
+
+
+def run_once(tickers, ttl, workers=SCHEDULER_WORKERS, cpu_seconds=SCHEDULER_CPU_SECONDS):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    import metrics
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    used, done, failed, pending = 0.0, 0, 0, {}
+    queue = list(tickers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        # at most one pipeline per worker in flight, so the budget is checked before each one starts
+        while queue or pending:
+            while queue and len(pending) < workers and used < cpu_seconds:
+                ticker = queue.pop(0)
+                pending[pool.submit(precompute, ticker, ttl)] = ticker
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                ticker = pending.pop(future)
+                try:
+                    used += future.result()
+                    done += 1
+                    metrics.inc('scheduler_pipelines_total', status='done')
+                except Exception as e:
+                    failed += 1
+                    metrics.inc('scheduler_pipelines_total', status='failed')
+                    logger.warning('precomputing %s failed : %r', ticker, e)
+    logger.info('precomputed %d tickers, %d failed, %d skipped over the CPU budget, %.0f CPU s',
+                done, failed, len(queue), used)
+    return {'done': done, 'failed': failed, 'skipped': len(queue), 'cpu_seconds': used}
+
+
+def next_run(tickers, times, after):
+    # (time, tickers of the exchanges that run first, time of their following run)
+    by_exchange = {}
+    for ticker in tickers:
+        by_exchange.setdefault(exchange_of(ticker), []).append(ticker)
+    runs = {exchange: upcoming_runs(exchange, times, after) for exchange in by_exchange}
+    runs = {exchange: r for exchange, r in runs.items() if r}
+    if not runs:
+        return None
+    at = min(r[0] for r in runs.values())
+    first = [exchange for exchange, r in runs.items() if r[0] == at]
+    following = min(runs[exchange][1] if len(runs[exchange]) > 1 else at + 24 * 60 * 60 for exchange in first)
+    return at, [t for exchange in first for t in by_exchange[exchange]], following
+
+
+def run_forever(watchlist=None, times=None, stop=None):
+    times = parse_times(times or SCHEDULER_TIMES)
+    stop = stop or threading.Event()
+    # runs are looked up after the previous one, a run that came due during a long run starts right away
+    since = time.time()
+    while not stop.is_set():
+        tickers = plan(watchlist if watchlist is not None else read_watchlist())
+        upcoming = next_run(tickers, times, since)
+        if upcoming is None:
+            # nothing to do yet, look again once requests came in
+            stop.wait(15 * 60)
+            continue
+        at, members, following = upcoming
+        if stop.wait(max(at - time.time(), 0)):
+            break
+        logger.info('precomputing %d tickers', len(members))
+        # outputs stay until the run after this one, with some slack for its duration
+        run_once(members, ttl=following - time.time() + 60 * 60)
+        since = at
+
+
+_thread = None
+_checked_at = 0.0
+
+def _run_locked(lock):
+    global _thread
+    try:
+        run_forever()
+    except Exception:
+        logger.exception('the scheduler stopped')
+    finally:
+        # give the scheduler up, this or another worker starts it again at its next check
+        lock.close()
+        _thread = None
+
+
+def ensure_started(lock_path=os.path.join('cache', 'scheduler.lock'), recheck=60):
+    # in-process mode: one web worker at a time runs the scheduler on a thread. It holds an flock
+    # on lock_path, which the OS drops when that worker exits, crashes or is recycled, however long
+    # a run takes; the other workers try to take it again every `recheck` seconds
+    global _thread, _checked_at
+    if not SCHEDULER_IN_PROCESS or _thread is not None or time.time() - _checked_at < recheck:
+        return
+    import fcntl
+    _checked_at = time.time()
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return
+    _thread = threading.Thread(target=_run_locked, args=(lock,), name='scheduler', daemon=True)
+    _thread.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute dashboard results before they are requested.')
+    parser.add_argument('tickers', nargs='*', help='added to the watchlist')
+    parser.add_argument('--watchlist', default=SCHEDULER_WATCHLIST, help='text file with one ticker per line')
+    parser.add_argument('--times', default=SCHEDULER_TIMES)
+    parser.add_argument('--once', action='store_true', help='one run of every planned ticker now')
+    parser.add_argument('--workers', type=int, default=SCHEDULER_WORKERS)
+    parser.add_argument('--cpu-seconds', type=float, default=SCHEDULER_CPU_SECONDS)
+    parser.add_argument('--ttl', type=float, default=24 * 60 * 60, help='lifetime of the results of --once')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    watchlist = list(args.tickers) + read_watchlist(args.watchlist)
+    if args.once:
+        tickers = plan(watchlist)
+        print('{} tickers : {}'.format(len(tickers), ' '.join(tickers)))
+        result = run_once(tickers, args.ttl, args.workers, args.cpu_seconds)
+        print(result)
+        return 1 if tickers and not result['done'] else 0
+    upcoming = next_run(plan(watchlist), parse_times(args.times), time.time())
+    if upcoming is not None:
+        print('next run at {} for {}'.format(time.strftime('%Y-%m-%d %H:%M %Z', time.localtime(upcoming[0])),
+                                             ' '.join(upcoming[1])))
+    run_forever(watchlist, args.times)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
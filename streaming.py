@@ -0,0 +1,247 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+import numpy as np
+
+import metrics
+
+'''
+Streaming forecasts for many symbols.
+Bars come from a Feed, one tick (every symbol's bar at one timestamp) at a
+time; ReplayFeed plays a local file of (ticker, Date, Close) rows back and
+stands in for a live source. StreamState keeps, per symbol, the running
+mean / variance of the log returns (Welford, the scaler of global_model's
+normalized returns), a ring buffer of the last look_back returns and a ring of
+the last STREAM_DISPLAY closes with the forecast made for each of them, so a
+bar costs the same whatever the length of the history and nothing is refitted.
+After each tick the global model forecasts the next close of every symbol that
+has look_back returns, in one batched call.
+The state arrays are memory-mapped .npy files under STREAM_DIR, updated in
+place: the dashboard maps them read-only and sees every tick as it lands
+(latest()), and a restarted stream resumes from them.
+
+    python global_model.py universe.txt
+    python streaming.py bars.csv --speed 60
+'''
+
+STREAM_DIR = os.environ.get('STREAM_DIR', os.path.join('cache', 'stream'))
+STREAM_DISPLAY = int(os.environ.get('STREAM_DISPLAY', 390))
+
+# name : (shape after the symbol axis, dtype, initial value)
+FIELDS = {'last_close': ((), np.float64, np.nan),
+          'returns': ((), np.int64, 0),
+          'mean': ((), np.float64, 0.0),
+          'm2': ((), np.float64, 0.0),
+          'forecast': ((), np.float64, np.nan),
+          'window': (('look_back',), np.float64, 0.0),
+          'times': (('display',), np.int64, 0),
+          'closes': (('display',), np.float32, np.nan),
+          'predicted': (('display',), np.float32, np.nan),
+          'bars': ((), np.int64, 0)}
+
+
+class Feed:
+    def ticks(self):
+        # yields (timestamp, tickers, closes), one entry per symbol
+        raise NotImplementedError
+
+
+class ReplayFeed(Feed):
+    # csv or parquet with ticker, Date and Close columns; speed: replayed seconds per real second, 0 = no pauses
+    def __init__(self, path, speed=0.0, time_column='Date'):
+        self.path = path
+        self.speed = speed
+        self.time_column = time_column
+
+    def ticks(self):
+        import pandas as pd
+        df = pd.read_parquet(self.path) if self.path.endswith('.parquet') else pd.read_csv(self.path)
+        df[self.time_column] = pd.to_datetime(df[self.time_column])
+        df = df.drop_duplicates(['ticker', self.time_column], keep='last').sort_values(self.time_column, kind='stable')
+        previous = None
+        for timestamp, bars in df.groupby(self.time_column, sort=False):
+            if self.speed and previous is not None:
+                time.sleep((timestamp - previous).total_seconds() / self.speed)
+            previous = timestamp
+            yield timestamp, bars['ticker'].to_numpy(dtype=str), bars['Close'].to_numpy(dtype=np.float64)
+
+
+class StreamState:
+    def __init__(self, directory=STREAM_DIR, look_back=30, display=STREAM_DISPLAY, capacity=1024):
+        self.directory = directory
+        self.look_back = look_back
+        self.display = display
+        meta = _read_meta(directory)
+        if meta is not None and (meta['look_back'], meta['display']) == (look_back, display):
+            # resume where the last run stopped
+            self.tickers = meta['tickers']
+            self.arrays = _open(directory, meta, 'r+')
+            self.capacity = meta['capacity']
+            self.version = meta['version']
+        else:
+            self.tickers, self.arrays, self.capacity, self.version = [], None, 0, None
+            self._allocate(capacity)
+        self.rows = {ticker: row for row, ticker in enumerate(self.tickers)}
+
+    def _shape(self, capacity, shape):
+        sizes = {'look_back': self.look_back, 'display': self.display}
+        return (capacity,) + tuple(sizes[s] for s in shape)
+
+    def _allocate(self, capacity):
+        # new files for a bigger symbol axis, the old rows are copied over
+        os.makedirs(self.directory, exist_ok=True)
+        version = '{:x}'.format(time.time_ns())
+        arrays = {}
+        for name, (shape, dtype, initial) in FIELDS.items():
+            path = os.path.join(self.directory, '{}.{}.npy'.format(name, version))
+            arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=self._shape(capacity, shape))
+            arrays[name][:] = initial
+            if self.arrays is not None:
+                arrays[name][:self.capacity] = self.arrays[name]
+        old = self.version
+        self.arrays, self.capacity, self.version = arrays, capacity, version
+        self._write_meta()
+        for path in glob.glob(os.path.join(self.directory, '*.{}.npy'.format(old))):
+            os.remove(path)
+
+    def _write_meta(self):
+        path = os.path.join(self.directory, 'stream.json')
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'tickers': self.tickers, 'capacity': self.capacity, 'version': self.version,
+                       'look_back': self.look_back, 'display': self.display}, f)
+        os.replace(tmp, path)
+
+    def _rows(self, tickers):
+        added = [t for t in dict.fromkeys(tickers) if t not in self.rows]
+        if added:
+            for ticker in added:
+                self.rows[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+            if len(self.tickers) > self.capacity:
+                capacity = self.capacity
+                while capacity < len(self.tickers):
+                    capacity *= 2
+                self._allocate(capacity)
+            else:
+                self._write_meta()
+        return np.fromiter((self.rows[t] for t in tickers), dtype=np.int64, count=len(tickers))
+
+    def update(self, timestamp, tickers, closes):
+        # O(1) per bar; returns the rows that have a full window of returns
+        rows = self._rows(tickers)
+        a = self.arrays
+        closes = np.asarray(closes, dtype=np.float64)
+        previous = a['last_close'][rows]
+        seen = np.isfinite(previous) & (closes > 0)
+        r, rows_r = np.log(closes[seen] / previous[seen]), rows[seen]
+        # Welford's update of the return mean and variance
+        count = a['returns'][rows_r] + 1
+        delta = r - a['mean'][rows_r]
+        mean = a['mean'][rows_r] + delta / count
+        a['m2'][rows_r] += delta * (r - mean)
+        a['mean'][rows_r] = mean
+        a['window'][rows_r, (count - 1) % self.look_back] = r
+        a['returns'][rows_r] = count
+        a['last_close'][rows] = closes
+
+        slot = a['bars'][rows] % self.display
+        a['times'][rows, slot] = np.datetime64(timestamp, 'ns').astype(np.int64)
+        a['closes'][rows, slot] = closes
+        a['predicted'][rows, slot] = a['forecast'][rows]
+        a['bars'][rows] += 1
+        return rows[a['returns'][rows] >= self.look_back]
+
+    def sigma(self, rows):
+        a = self.arrays
+        sigma = np.sqrt(a['m2'][rows] / np.maximum(a['returns'][rows], 1))
+        return np.where(sigma > 0, sigma, 1.0)
+
+    def windows(self, rows):
+        # the last look_back returns of each row, oldest first, divided by the running sigma
+        order = (self.arrays['returns'][rows, np.newaxis] + np.arange(self.look_back)) % self.look_back
+        z = self.arrays['window'][rows[:, np.newaxis], order] / self.sigma(rows)[:, np.newaxis]
+        return z[:, :, np.newaxis].astype(np.float32)
+
+    def set_forecast(self, rows, z):
+        # z : the model's next normalized return of each row
+        a = self.arrays
+        a['forecast'][rows] = a['last_close'][rows] * np.exp(self.sigma(rows) * np.asarray(z, dtype=np.float64))
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'stream.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _open(directory, meta, mode):
+    return {name: np.load(os.path.join(directory, '{}.{}.npy'.format(name, meta['version'])), mmap_mode=mode)
+            for name in FIELDS}
+
+
+def latest(ticker, directory=STREAM_DIR):
+    # the displayed bars of one ticker, oldest first, None when it is not streamed
+    from price_store import ticker_key
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+    keys = [ticker_key(t) for t in meta['tickers']]
+    if ticker_key(ticker) not in keys:
+        return None
+    row = keys.index(ticker_key(ticker))
+    try:
+        a = _open(directory, meta, 'r')
+    except FileNotFoundError:
+        # the stream grew and replaced its files in between
+        return None
+    bars = int(a['bars'][row])
+    n = min(bars, meta['display'])
+    order = (bars - n + np.arange(n)) % meta['display']
+    return {'times': a['times'][row, order].astype('datetime64[ns]'),
+            'closes': np.array(a['closes'][row, order]),
+            'predicted': np.array(a['predicted'][row, order]),
+            'forecast': float(a['forecast'][row])}
+
+
+def run(feed, state, model):
+    for timestamp, tickers, closes in feed.ticks():
+        start = time.perf_counter()
+        ready = state.update(timestamp, tickers, closes)
+        if len(ready):
+            state.set_forecast(ready, np.asarray(model(state.windows(ready), training=False))[:, 0])
+        metrics.observe('stream_tick_seconds', time.perf_counter() - start)
+        yield timestamp, len(tickers), len(ready)
+
+
+def main(argv=None):
+    from global_model import GLOBAL_LOOK_BACK, GLOBAL_UNITS, load_global
+    parser = argparse.ArgumentParser(description='Stream bars through the global model.')
+    parser.add_argument('replay', help='csv or parquet file with ticker, Date and Close columns')
+    parser.add_argument('--speed', type=float, default=0.0, help='replayed seconds per second, 0 = no pauses')
+    parser.add_argument('--look-back', type=int, default=GLOBAL_LOOK_BACK)
+    parser.add_argument('--units', type=int, default=GLOBAL_UNITS)
+    parser.add_argument('--display', type=int, default=STREAM_DISPLAY)
+    parser.add_argument('--directory', default=STREAM_DIR)
+    args = parser.parse_args(argv)
+
+    model = load_global(args.look_back, args.units)
+    state = StreamState(args.directory, args.look_back, args.display)
+    start, bars, ticks = time.perf_counter(), 0, 0
+    for timestamp, n_bars, n_ready in run(ReplayFeed(args.replay, args.speed), state, model):
+        bars, ticks = bars + n_bars, ticks + 1
+        if ticks % 100 == 0:
+            print('{} : {} bars, {} forecasts'.format(timestamp, n_bars, n_ready))
+    seconds = time.perf_counter() - start
+    print('{} bars in {} ticks, {:.1f} s ({:.0f} bars/s)'.format(bars, ticks, seconds, bars / max(seconds, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
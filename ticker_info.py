@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from price_store import ticker_key
+
+'''
+Ticker metadata store.
+yfinance.Ticker(...).info is a slow, often rate-limited call whose answer
+hardly ever changes, so the fields the dashboard shows are kept in
+INFO_DIR/<TICKER>.json for INFO_TTL seconds. Each process keeps the most recently
+used INFO_MEMORY_SLOTS entries in memory, and only the INFO_MAX_ENTRIES most
+recently used files are kept on disk (a hit touches the file).
+prefetch() starts a lookup on a background thread so it overlaps the price
+download. A failed lookup never raises: the last known metadata is served if
+there is any, otherwise an empty dict, and the failure is remembered for
+INFO_ERROR_TTL seconds so a rate-limited ticker is not retried on every request.
+'''
+
+INFO_DIR = os.environ.get('TICKER_INFO_DIR', os.path.join('cache', 'ticker_info'))
+INFO_TTL = int(os.environ.get('TICKER_INFO_TTL', 7 * 24 * 60 * 60))
+INFO_ERROR_TTL = int(os.environ.get('TICKER_INFO_ERROR_TTL', 10 * 60))
+INFO_MAX_ENTRIES = int(os.environ.get('TICKER_INFO_MAX_ENTRIES', 5000))
+INFO_MEMORY_SLOTS = int(os.environ.get('TICKER_INFO_MEMORY_SLOTS', 256))
+INFO_TIMEOUT = float(os.environ.get('TICKER_INFO_TIMEOUT', 20))
+FIELDS = ('longName', 'shortName', 'longBusinessSummary', 'sector', 'industry', 'currency', 'exchange')
+
+logger = logging.getLogger('stock.ticker_info')
+
+
+class InfoSource:
+    def fetch(self, ticker):
+        raise NotImplementedError
+
+
+class YahooInfoSource(InfoSource):
+    def fetch(self, ticker):
+        import yfinance
+        return yfinance.Ticker(ticker).info
+
+
+class JSONInfoSource(InfoSource):
+    # offline / fixture provider, reads <directory>/<ticker>.info.json
+    def __init__(self, directory='.'):
+        self.directory = directory
+
+    def fetch(self, ticker):
+        path = os.path.join(self.directory, '{}.info.json'.format(ticker))
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+
+def source_from_env():
+    spec = os.environ.get('PRICE_SOURCE', 'yahoo')
+    if spec.startswith('csv:'):
+        return JSONInfoSource(spec[len('csv:'):])
+    return YahooInfoSource()
+
+
+class TickerInfoStore:
+    def __init__(self, source=None, directory=INFO_DIR, ttl=INFO_TTL, error_ttl=INFO_ERROR_TTL,
+                 max_entries=INFO_MAX_ENTRIES, memory_slots=INFO_MEMORY_SLOTS):
+        self.source = source if source is not None else source_from_env()
+        self.directory = directory
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.memory_slots = memory_slots
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, ticker_key(ticker) + '.json')
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_slots:
+                self._memory.popitem(last=False)
+
+    def _fresh(self, entry):
+        ttl = self.error_ttl if entry.get('error') else self.ttl
+        return time.time() - entry['checked_at'] < ttl
+
+    def _read(self, ticker):
+        path = self._path(ticker)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # the file's mtime is its last use, _prune drops the least recently used
+        os.utime(path)
+        return entry
+
+    def _write(self, ticker, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(ticker)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self):
+        names = [n for n in os.listdir(self.directory) if n.endswith('.json')]
+        if len(names) <= self.max_entries:
+            return
+        paths = sorted((os.path.join(self.directory, n) for n in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, ticker):
+        key = ticker_key(ticker)
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None or not self._fresh(entry):
+            entry = self._read(ticker) or entry
+        if entry is not None and self._fresh(entry):
+            metrics.inc('ticker_info_requests_total', result='hit')
+            self._remember(key, entry)
+            return dict(entry['info'])
+
+        try:
+            raw = self.source.fetch(ticker) or {}
+            info = {k: raw[k] for k in FIELDS if raw.get(k) is not None}
+            entry = {'info': info, 'checked_at': time.time(), 'fetched_at': time.time(), 'error': None}
+            metrics.inc('ticker_info_requests_total', result='miss')
+        except Exception as e:
+            logger.warning('ticker info lookup for %s failed: %r', ticker, e)
+            metrics.inc('ticker_info_requests_total', result='error')
+            # keep serving what we had, and wait error_ttl before asking again
+            previous = entry['info'] if entry is not None else {}
+            entry = {'info': previous, 'checked_at': time.time(),
+                     'fetched_at': entry.get('fetched_at') if entry is not None else None, 'error': repr(e)}
+        self._remember(key, entry)
+        try:
+            self._write(ticker, entry)
+        except OSError as e:
+            logger.warning('could not store ticker info for %s: %r', ticker, e)
+        return dict(entry['info'])
+
+    def prefetch(self, ticker):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ticker-info')
+        return self._pool.submit(self.get, ticker)
+
+
+def business_summary(lookup, timeout=INFO_TIMEOUT):
+    # lookup : a dict from get() or the future returned by prefetch()
+    if hasattr(lookup, 'result'):
+        try:
+            lookup = lookup.result(timeout=timeout)
+        except Exception:
+            lookup = {}
+    return lookup.get('longBusinessSummary') or "No company description is available for this ticker right now."
+
+
+_default_info_store = None
+
+def default_info_store():
+    global _default_info_store
+    if _default_info_store is None:
+        _default_info_store = TickerInfoStore()
+    return _default_info_store
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+'''
+Hyperparameter search for the dashboard model.
+Random configurations of look_back and LSTM units are trained with successive
+halving: every trial gets --min-epochs, the best 1/eta of them continue from
+their saved weights up to eta times as many epochs, and so on up to
+--max-epochs. Trials that diverge stop at once (TerminateOnNaN). Trials run on a
+spawn process pool; the series of a ticker is put in shared memory once and
+every trial builds its windows as views of it. Trials are trained like
+app.py's run_pipeline trains the served model (unscaled closes, its input
+pipeline and build_model) and scored on the last --validation fraction of its
+training split, the test split is not used for selection.
+The winner is written to TUNING_DIR/<TICKER>.json, where app.py's run_pipeline
+reads its look_back, units and epochs; tickers without one use DEFAULT_CONFIG.
+
+    python tuning.py AAPL MSFT --trials 27 --max-epochs 27
+'''
+
+TUNING_DIR = os.environ.get('TUNING_DIR', os.path.join('cache', 'tuning'))
+DEFAULT_CONFIG = {'look_back': 15, 'units': 10, 'epochs': 7}
+SPACE = {'look_back': [15, 30, 60, 90], 'units': [10, 16, 32, 64, 128]}
+
+
+def _path(ticker, directory=TUNING_DIR):
+    from price_store import ticker_key
+    return os.path.join(directory, ticker_key(ticker) + '.json')
+
+
+def best_config(ticker, directory=TUNING_DIR):
+    try:
+        with open(_path(ticker, directory)) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return dict(DEFAULT_CONFIG)
+    return {k: saved.get(k, v) for k, v in DEFAULT_CONFIG.items()}
+
+
+def save_config(ticker, config, directory=TUNING_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = _path(ticker, directory)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(dict(config, ticker=ticker.upper(), created_at=time.time()), f)
+    os.replace(tmp, path)
+
+
+def sample_configs(n, seed=None):
+    # distinct random points of SPACE, all of them when n covers the space
+    import itertools
+    grid = list(itertools.product(*SPACE.values()))
+    rng = np.random.default_rng(seed)
+    picked = rng.permutation(len(grid))[:n]
+    return [dict(zip(SPACE, grid[i])) for i in picked]
+
+
+def rungs(min_epochs, max_epochs, eta):
+    epochs = [min_epochs]
+    while epochs[-1] * eta <= max_epochs:
+        epochs.append(epochs[-1] * eta)
+    return epochs
+
+
+_attached = {}
+
+def _series(name, shape):
+    # attached once per worker process, the array is a view of the shared block
+    from multiprocessing import shared_memory
+    if name not in _attached:
+        # the next ticker's round: the parent has unlinked the previous block, let it go
+        for previous in list(_attached):
+            block, _ = _attached.pop(previous)
+            block.close()
+        block = shared_memory.SharedMemory(name=name)
+        _attached[name] = (block, np.ndarray(shape, dtype=np.float64, buffer=block.buf))
+    return _attached[name][1]
+
+
+def run_trial(config, data, epochs_done, epochs, weights, seed=0):
+    # data : (shared memory name, shape, validation start); trains epochs_done -> epochs
+    import keras
+    from app import build_model, sequence_to_supervised
+    from windowing import make_windows
+    name, shape, val_start = data
+    series = _series(name, shape)
+    look_back = config['look_back']
+    keras.utils.set_random_seed(seed)
+    start = time.perf_counter()
+    model = build_model(look_back, config['units'])
+    if epochs_done:
+        model.load_weights(weights)
+    train_generator, _ = sequence_to_supervised(look_back, series[:val_start], series[val_start - look_back:])
+    model.fit(train_generator, initial_epoch=epochs_done, epochs=epochs, verbose=0,
+              callbacks=[keras.callbacks.TerminateOnNaN()])
+    model.save_weights(weights)
+    x, y = make_windows(series[val_start - look_back:], look_back)
+    prediction = np.asarray(model(x.astype(np.float32), training=False))[:, 0]
+    val_mse = float(np.mean((prediction - y) ** 2))
+    return (val_mse if np.isfinite(val_mse) else float('inf')), time.perf_counter() - start
+
+
+def tune(ticker, pool, trials=27, eta=3, min_epochs=1, max_epochs=27, validation=0.2, seed=0):
+    from multiprocessing import shared_memory
+    import app
+    df, close_data, _ = app.download_and_process_data(ticker)
+    close_train, _, _, _ = app.split_data(close_data, df)
+    # unscaled, like the closes run_pipeline trains the served model on
+    series = np.ascontiguousarray(close_train, dtype=np.float64)
+    val_start = int(len(series) * (1 - validation))
+    if val_start <= max(SPACE['look_back']) or len(series) - val_start < 2:
+        raise ValueError('{} bars are too few to tune {}'.format(len(series), ticker))
+
+    block = shared_memory.SharedMemory(create=True, size=series.nbytes)
+    try:
+        np.ndarray(series.shape, dtype=np.float64, buffer=block.buf)[:] = series
+        data = (block.name, series.shape, val_start)
+        with tempfile.TemporaryDirectory() as folder:
+            alive = [{'config': config, 'weights': os.path.join(folder, '{}.weights.h5'.format(n)),
+                      'epochs': 0, 'val_mse': None, 'seconds': 0.0}
+                     for n, config in enumerate(sample_configs(trials, seed))]
+            history = []
+            for epochs in rungs(min_epochs, max_epochs, eta):
+                futures = [pool.submit(run_trial, t['config'], data, t['epochs'], epochs, t['weights'], seed)
+                           for t in alive]
+                for trial, future in zip(alive, futures):
+                    trial['val_mse'], seconds = future.result()
+                    trial['epochs'] = epochs
+                    trial['seconds'] += seconds
+                    history.append(dict(trial['config'], epochs=epochs, val_mse=trial['val_mse']))
+                alive.sort(key=lambda t: t['val_mse'])
+                print('{} : {} trials at {} epochs, best {} val mse {:.3g}'.format(
+                    ticker, len(alive), epochs, alive[0]['config'], alive[0]['val_mse']))
+                alive = alive[:max(1, len(alive) // eta)]
+    finally:
+        block.close()
+        block.unlink()
+    best = alive[0]
+    return dict(best['config'], epochs=best['epochs'], val_mse=best['val_mse'], trials=len(history))
+
+
+def main(argv=None):
+    from batch_forecast import read_universe, pin_threads
+    parser = argparse.ArgumentParser(description='Successive halving search of look_back, units and epochs.')
+    parser.add_argument('tickers', nargs='*')
+    parser.add_argument('--universe', help='text file with one ticker per line')
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--eta', type=int, default=3, help='keep the best 1/eta trials at every rung')
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--max-epochs', type=int, default=27)
+    parser.add_argument('--validation', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=0,
+                        help='intra-op threads per worker, default: cores / workers')
+    parser.add_argument('--dry-run', action='store_true', help='print the best configs without saving them')
+    args = parser.parse_args(argv)
+
+    tickers = list(args.tickers) + (read_universe(args.universe) if args.universe else [])
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=pin_threads, initargs=(threads,)) as pool:
+        for ticker in tickers:
+            start = time.perf_counter()
+            try:
+                best = tune(ticker, pool, args.trials, args.eta, args.min_epochs, args.max_epochs,
+                            args.validation, args.seed)
+            except Exception as e:
+                failed += 1
+                print('{} failed : {!r}'.format(ticker, e))
+                continue
+            if not args.dry_run:
+                save_config(ticker, best)
+            print('{} : {} in {:.1f} s'.format(ticker, best, time.perf_counter() - start))
+    return 1 if failed and failed == len(tickers) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
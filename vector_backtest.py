@@ -0,0 +1,171 @@
+import sys
+import argparse
+import itertools
+
+import numpy as np
+
+'''
+Vectorized backtests of prediction driven strategies.
+The notebook's BuyHoldSell strategy goes long when the predicted return
+RETURN = prediction[t] / actual[t-1] - 1 rises above a threshold and short (or,
+with rule='long_only', flat) when it falls below minus the threshold; nothing
+happens before the first buy. Here every combination of threshold, commission
+and rule in a grid is simulated at once on (combinations, bars) arrays instead
+of bar by bar: positions are the forward-filled signals, trades are the runs of
+equal position, and equity is rebuilt from per-trade returns with a cumulative
+product. Orders fill at the next bar's open when opens are given (like the
+backtesting library), otherwise at the close of the signal bar. Commission is
+charged as a fraction of the traded value on entry and exit.
+'''
+
+RULES = ('long_short', 'long_only')
+STATS = ('Equity Final [$]', 'Return [%]', 'Buy & Hold Return [%]', 'Max. Drawdown [%]',
+         'Exposure Time [%]', '# Trades', 'Win Rate [%]', 'Sharpe Ratio')
+
+
+def predicted_returns(predicted, actual):
+    # the notebook's RETURN indicator
+    predicted, actual = np.asarray(predicted, dtype=np.float64), np.asarray(actual, dtype=np.float64)
+    returns = np.zeros(len(actual))
+    returns[1:] = predicted[1:] / actual[:-1] - 1
+    return returns
+
+
+def positions(returns, thresholds, rules):
+    # (combinations, bars) array of -1 / 0 / 1, the position wanted after each bar
+    n = len(returns)
+    thresholds = np.asarray(thresholds, dtype=np.float64)[:, np.newaxis]
+    up, down = returns > thresholds, returns < -thresholds
+    short = np.asarray([rule == 'long_short' for rule in rules])[:, np.newaxis]
+    signal = np.where(up, 1, np.where(short, -1, 0)).astype(np.int8)
+    # forward fill the last signal, nothing is held before the first one
+    last = np.maximum.accumulate(np.where(up | down, np.arange(n, dtype=np.int32), -1), axis=1)
+    state = np.where(last >= 0, np.take_along_axis(signal, np.maximum(last, 0), axis=1), 0)
+    # a sell signal only closes or reverses a long position
+    first_buy = np.where(up.any(axis=1), up.argmax(axis=1), n)[:, np.newaxis]
+    state[np.arange(n) < first_buy] = 0
+    return state.astype(np.int8)
+
+
+def simulate(close, position, commission, fill=None, cash=10_000):
+    # position : (combinations, bars) held after each bar's fill, fill : fill price per bar
+    g, n = position.shape
+    close = np.asarray(close, dtype=np.float64)
+    fill = close if fill is None else np.asarray(fill, dtype=np.float64)
+    commission = np.broadcast_to(np.asarray(commission, dtype=np.float64).reshape((-1, 1)), (g, 1))
+
+    starts = np.empty((g, n), dtype=bool)
+    starts[:, 0] = True
+    np.not_equal(position[:, 1:], position[:, :-1], out=starts[:, 1:])
+    # one entry per run of equal position, runs never cross rows since every row starts one
+    segment = (np.cumsum(starts.reshape((-1))) - 1).reshape((g, n))
+    rows, cols = np.nonzero(starts)
+    entry = fill[cols]
+    side = position[rows, cols].astype(np.float64)
+    fee = commission[rows, 0]
+    # a run exits at the fill of the next run in its row, the last run is marked at the last close
+    closed = np.append(rows[1:] == rows[:-1], False)
+    exit_price = np.where(closed, np.append(entry[1:], close[-1]), close[-1])
+    held = side != 0
+    gross = np.where(held, (1 - fee) * (1 + side * (exit_price / entry - 1)) * np.where(closed, 1 - fee, 1), 1.0)
+    # equity before each run: product of the earlier runs' gross returns in the same row
+    logs = np.log(np.maximum(gross, 1e-300))
+    earlier = np.cumsum(logs) - logs
+    before = np.exp(earlier - earlier[np.searchsorted(rows, rows)])
+
+    # inside a run equity is linear in the close: intercept + slope * close
+    base = cash * before * np.where(held, 1 - fee, 1)
+    slope = base * side / entry
+    equity = (base - slope * entry)[segment]
+    equity += slope[segment] * close
+    won = held & (side * (exit_price - entry) > 0)
+    return equity, np.bincount(rows, held, g).astype(np.int64), np.bincount(rows, won, g).astype(np.int64), \
+        (position != 0).mean(axis=1)
+
+
+def stats(close, equity, n_trades, n_won, exposure, cash=10_000, periods_per_year=252):
+    close = np.asarray(close, dtype=np.float64)
+    peak = np.maximum.accumulate(equity, axis=1)
+    returns = np.diff(equity, axis=1) / equity[:, :-1]
+    volatility = returns.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0, returns.mean(axis=1) / volatility * np.sqrt(periods_per_year), np.nan)
+        win_rate = np.where(n_trades > 0, 100 * n_won / n_trades, np.nan)
+    return {'Equity Final [$]': equity[:, -1],
+            'Return [%]': 100 * (equity[:, -1] / cash - 1),
+            'Buy & Hold Return [%]': np.full(len(equity), 100 * (close[-1] / close[0] - 1)),
+            'Max. Drawdown [%]': 100 * (equity / peak - 1).min(axis=1),
+            'Exposure Time [%]': 100 * exposure,
+            '# Trades': n_trades,
+            'Win Rate [%]': win_rate,
+            'Sharpe Ratio': sharpe}
+
+
+def parameter_grid(thresholds, commissions=(0.002,), rules=('long_short',)):
+    combos = list(itertools.product(thresholds, commissions, rules))
+    return ([c[0] for c in combos], [c[1] for c in combos], [c[2] for c in combos])
+
+
+def run_grid(actual, predicted, thresholds, commissions=(0.002,), rules=('long_short',), opens=None,
+             cash=10_000, chunk=1024):
+    # every combination of the three lists, returns a DataFrame with one row per combination
+    import pandas as pd
+    actual = np.asarray(actual, dtype=np.float64)
+    returns = predicted_returns(predicted, actual)
+    grid = parameter_grid(thresholds, commissions, rules)
+    frames = []
+    # chunks bound the (combinations, bars) temporaries
+    for i in range(0, len(grid[0]), chunk):
+        t, c, r = (column[i:i + chunk] for column in grid)
+        wanted = positions(returns, t, r)
+        if opens is None:
+            held, fill = wanted, actual
+        else:
+            # decided on the close, filled at the next open
+            held = np.concatenate([np.zeros((len(t), 1), dtype=np.int8), wanted[:, :-1]], axis=1)
+            fill = opens
+        result = stats(actual, *simulate(actual, held, c, fill, cash), cash=cash)
+        frames.append(pd.DataFrame(dict(result, threshold=t, commission=c, rule=r)))
+    return pd.concat(frames, ignore_index=True)[['threshold', 'commission', 'rule'] + list(STATS)]
+
+
+def _range(text):
+    # "0:0.1:0.005" (start:stop:step) or a single value
+    if ':' in text:
+        start, stop, step = (float(v) for v in text.split(':'))
+        return list(np.arange(start, stop + step / 2, step))
+    return [float(text)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep BuyHoldSell parameters over a prediction file.')
+    parser.add_argument('path', help='csv or parquet file with the actual and predicted prices')
+    parser.add_argument('--actual', default='actual')
+    parser.add_argument('--prediction', default='prediction')
+    parser.add_argument('--open', help='column with the opens, fills at the next open when given')
+    parser.add_argument('--thresholds', default='0:0.1:0.001')
+    parser.add_argument('--commissions', nargs='+', type=float, default=[0.002])
+    parser.add_argument('--rules', nargs='+', choices=RULES, default=['long_short'])
+    parser.add_argument('--cash', type=float, default=10_000)
+    parser.add_argument('--sort', default='Return [%]')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', help='write every combination to this csv file')
+    args = parser.parse_args(argv)
+
+    import time
+    import pandas as pd
+    df = pd.read_parquet(args.path) if args.path.endswith('.parquet') else pd.read_csv(args.path)
+    start = time.perf_counter()
+    result = run_grid(df[args.actual].values, df[args.prediction].values, _range(args.thresholds),
+                      args.commissions, args.rules, None if args.open is None else df[args.open].values,
+                      args.cash)
+    seconds = time.perf_counter() - start
+    print(result.sort_values(args.sort, ascending=False).head(args.top).to_string(index=False))
+    print('{} combinations over {} bars in {:.2f} s'.format(len(result), len(df), seconds))
+    if args.output:
+        result.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
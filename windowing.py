@@ -0,0 +1,77 @@
+import numpy as np
+
+'''
+Supervised windows over a price series.
+make_windows returns strided views of the data (no window is copied) with the
+same layout as keras TimeseriesGenerator: x[i] = data[i:i+look_back] and
+y[i] = the next `horizon` values of the target column.
+make_dataset serves the same windows as a prefetching tf.data pipeline, each
+batch is gathered from a single copy of the series when it is needed.
+Data can be one series (n,) / (n, 1) or several features (n, features), e.g.
+Close, Open, High, Low, Volume with the target in target_column.
+'''
+
+
+def _as_matrix(data, dtype=None):
+    data = np.asarray(data, dtype=dtype)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    return data
+
+
+def _count(data, look_back, horizon):
+    n_windows = len(data) - look_back - horizon + 1
+    if n_windows < 1:
+        raise ValueError('{} rows are not enough for look_back={} and horizon={}'.format(
+            len(data), look_back, horizon))
+    return n_windows
+
+
+def make_windows(data, look_back, horizon=1, target_column=0):
+    from numpy.lib.stride_tricks import sliding_window_view
+    data = _as_matrix(data)
+    n_windows = _count(data, look_back, horizon)
+    x = sliding_window_view(data, look_back, axis=0)[:n_windows].transpose(0, 2, 1)
+    target = data[look_back:, target_column]
+    if horizon == 1:
+        return x, target[:n_windows]
+    return x, sliding_window_view(target, horizon)[:n_windows]
+
+
+def make_dataset(data, look_back, batch_size=256, horizon=1, target_column=0, shuffle=False, seed=None,
+                 in_memory=True):
+    # in_memory=False gathers every batch from `data` itself, e.g. a memory-mapped
+    # feature matrix, instead of copying the whole series into a tensor first
+    import tensorflow as tf
+    data = _as_matrix(data, np.float32)
+    n_windows = _count(data, look_back, horizon)
+    if in_memory:
+        series = tf.constant(data)
+        target = series[:, target_column]
+        window_offsets = tf.range(look_back, dtype=tf.int64)
+        target_offsets = tf.range(look_back, look_back + horizon, dtype=tf.int64)
+
+        def gather(index):
+            x = tf.gather(series, index[:, tf.newaxis] + window_offsets)
+            y = tf.gather(target, index[:, tf.newaxis] + target_offsets)
+            return x, y
+    else:
+        window_offsets = np.arange(look_back)
+        target_offsets = np.arange(look_back, look_back + horizon)
+
+        def gather_batch(index):
+            return (data[index[:, np.newaxis] + window_offsets],
+                    data[index[:, np.newaxis] + target_offsets, target_column])
+
+        def gather(index):
+            x, y = tf.numpy_function(gather_batch, [index], (tf.float32, tf.float32))
+            x.set_shape((None, look_back, data.shape[1]))
+            y.set_shape((None, horizon))
+            return x, y
+
+    dataset = tf.data.Dataset.range(n_windows)
+    if shuffle:
+        dataset = dataset.shuffle(n_windows, seed=seed, reshuffle_each_iteration=True)
+    return (dataset.batch(batch_size)
+            .map(gather, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))